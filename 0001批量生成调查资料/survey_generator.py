@@ -2,24 +2,36 @@
 # -*- coding: utf-8 -*-
 """
 批量生成调查表工具
-功能：读取Shapefile图层数据，使用Word模板批量填充占位符生成调查表
+功能：读取Shapefile/GeoPackage等图层数据，使用Word模板批量填充占位符生成调查表
 作者：Claude Code
 日期：2026-02-06
 """
 
+import argparse
+import copy
+import hashlib
+import io
+import json
 import os
 import re
+import shutil
 import sys
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple, Iterator, Any
+from typing import Dict, List, Tuple, Iterator, Any, Optional, Sequence, Union, NamedTuple, Callable, TextIO
 import warnings
 
 # 忽略geopandas的警告
 warnings.filterwarnings('ignore')
 
 try:
+    import numpy as np
+    import pandas as pd
     import geopandas as gpd
     from docx import Document
+    from docx.shared import Mm
     from tqdm import tqdm
 except ImportError as e:
     print(f"错误: 缺少必要的依赖库")
@@ -28,36 +40,307 @@ except ImportError as e:
     sys.exit(1)
 
 
-class ShapefileReader:
-    """Shapefile读取器"""
+# 占位符格式: !字段名[:格式][|字典]!，例如 !面积:.2f!、!日期:%Y年%m月%d日!、!权属|1=国有,2=集体!
+# 关联表字段写作 !关联表名.字段名!，所在的表格行按关联记录重复
+PLACEHOLDER_PATTERN = re.compile(
+    r'!(([A-Za-z0-9_\u4e00-\u9fa5]+(?:\.[A-Za-z0-9_\u4e00-\u9fa5]+)?)(?::([^!|\s]+))?(?:\|([^!\s]+))?)!'
+)
+
+# 可直接交给 numpy 按列格式化的数值格式（与 printf 语法一致的子集）
+_PRINTF_SPEC = re.compile(r'^[-+ 0#]?\d*(?:\.\d+)?[dfeEgG]$')
+
+# 日期格式以 strftime 指令识别，例如 %Y-%m-%d
+_DATE_SPEC = re.compile(r'%[A-Za-z]')
+
+# str.format 中只接受整数的类型码
+_INT_FORMAT_TYPES = 'bcdoxX'
+
+# Windows文件名中的非法字符
+_ILLEGAL_FILENAME_CHARS = r'[<>:"/\\|?*]'
+
+
+# 由几何计算得到的虚拟字段，仅在模板引用时计算；面积单位随坐标系（投影坐标系下为平方米）
+GEOMETRY_FIELDS = {
+    '_AREA': '面积',
+    '_AREA_MU': '面积（亩）',
+    '_AREA_HA': '面积（公顷）',
+    '_PERIMETER': '周长',
+    '_CENTROID_X': '中心点X',
+    '_CENTROID_Y': '中心点Y',
+    '_MINX': '最小X',
+    '_MINY': '最小Y',
+    '_MAXX': '最大X',
+    '_MAXY': '最大Y',
+    '_BBOX': '四至范围（最小X,最小Y,最大X,最大Y）',
+}
+
+SQUARE_METERS_PER_MU = 10000 / 15
+
+# 依赖长度单位的几何字段，地理坐标系下必须先投影
+MEASURE_FIELDS = ('_AREA', '_AREA_MU', '_AREA_HA', '_PERIMETER')
+
+# 图片占位符，格式说明为图片宽度（毫米），如 !_MAP:60!
+IMAGE_FIELDS = {
+    '_MAP': '位置示意图',
+}
+
+DEFAULT_IMAGE_WIDTH_MM = 60
+
+
+class PlaceholderSpec(NamedTuple):
+    """模板编译时解析出的占位符"""
+    token: str                              # 两个!之间的完整内容，也是记录中的键
+    field: str                              # 字段名
+    fmt: Optional[str] = None               # 格式说明，数值格式或日期格式
+    lookup: Optional[Dict[str, str]] = None  # 代码到名称的对照表
+
+    @property
+    def relation(self) -> Optional[str]:
+        """关联表名，非关联表字段返回 None"""
+        return self.field.split('.', 1)[0] if '.' in self.field else None
+
+    @property
+    def column(self) -> str:
+        """字段在数据表中的列名（去掉关联表名前缀）"""
+        return self.field.split('.', 1)[1] if '.' in self.field else self.field
+
+
+def format_column(series: 'pd.Series', fmt: Optional[str] = None,
+                  lookup: Optional[Dict[str, str]] = None) -> 'pd.Series':
+    """
+    按列格式化字段值，先按格式说明转换，再按对照表替换，空值转为空字符串
+
+    Args:
+        series: 字段列
+        fmt: 格式说明，含 strftime 指令时按日期处理，否则按数值格式处理
+        lookup: 代码到名称的对照表，表中不存在的值保持原样
+
+    Returns:
+        字符串列
+    """
+    missing = series.isna()
+    values = series.astype(str).str.strip()
+
+    if fmt and _DATE_SPEC.search(fmt):
+        dates = pd.to_datetime(series, errors='coerce')
+        valid = dates.notna()
+        if valid.any():
+            values[valid] = dates[valid].dt.strftime(fmt)
+    elif fmt:
+        numbers = pd.to_numeric(series, errors='coerce')
+        valid = numbers.notna()
+        if valid.any():
+            if _PRINTF_SPEC.match(fmt):
+                array = numbers[valid].to_numpy(dtype='float64')
+                if fmt.endswith('d'):
+                    array = np.round(array).astype('int64')
+                values[valid] = np.char.mod('%' + fmt, array)
+            else:
+                valid_numbers = numbers[valid]
+                if fmt[-1] in _INT_FORMAT_TYPES:
+                    # 整数格式（如 ,d）不接受 float，DBF数值列读出为 float64，与 %d 一样先取整
+                    valid_numbers = np.round(valid_numbers.to_numpy(dtype='float64')).astype('int64')
+                    valid_numbers = pd.Series(valid_numbers, index=values.index[valid])
+                values[valid] = valid_numbers.map(('{:' + fmt + '}').format)
+
+    if lookup:
+        mapped = values.map(lookup)
+        values = mapped.where(mapped.notna(), values)
+
+    values[missing] = ''
+    return values
+
+
+class RelatedTable:
+    """一对多关联表（DBF/CSV/Excel），生成前按关联字段建立一次哈希索引"""
 
-    def __init__(self, shp_path: str, encoding: str = 'gbk'):
+    def __init__(self, name: str, path: str, key: str, parent_key: str, encoding: Optional[str] = None):
         """
-        初始化Shapefile读取器
+        初始化关联表
 
         Args:
-            shp_path: Shapefile文件路径
-            encoding: 文件编码，默认gbk
+            name: 关联表名，模板中以 !关联表名.字段名! 引用
+            path: 数据文件路径（.dbf/.csv/.xlsx 等）
+            key: 关联表中的关联字段
+            parent_key: 主图层中的关联字段
+            encoding: 文件编码，为空时DBF默认gbk，CSV依次尝试utf-8、utf-8-sig、gbk
         """
-        self.shp_path = shp_path
+        self.name = name
+        self.path = path
+        self.key = key
+        self.parent_key = parent_key
         self.encoding = encoding
+        self.df = self._read()
+        if key not in self.df.columns:
+            raise ValueError(f"关联表 {name} 中不存在关联字段: {key}")
+        self.index = self._build_index()
+
+    def _read(self) -> 'pd.DataFrame':
+        """读取关联表，CSV按 utf-8、utf-8-sig、gbk 的顺序尝试，DBF编码失败时尝试utf-8"""
+        suffix = Path(self.path).suffix.lower()
+        if suffix == '.csv':
+            # 与主数据CSV相同的编码顺序：gbk几乎能无报错地解码UTF-8字节，不能先试
+            return CSVReader(self.path, encoding=self.encoding or 'utf-8').gdf
+        if suffix in ('.xlsx', '.xls'):
+            return pd.read_excel(self.path, dtype=str)
+
+        last_error = None
+        for encoding in dict.fromkeys([self.encoding or 'gbk', 'utf-8-sig']):
+            try:
+                df = read_vector(self.path, encoding=encoding)
+                return pd.DataFrame(df.drop(columns='geometry', errors='ignore'))
+            except Exception as e:
+                last_error = e
+        raise Exception(f"无法读取关联表 {self.path}: {last_error}")
+
+    def _build_index(self) -> Dict[str, 'np.ndarray']:
+        """建立 关联字段值 -> 行号数组 的哈希索引，空值不参与关联"""
+        keys = format_column(self.df[self.key]).reset_index(drop=True)
+        index = dict(keys.groupby(keys, sort=False).indices)
+        index.pop('', None)
+        return index
+
+    def get_fields(self) -> List[str]:
+        """获取关联表字段名"""
+        return list(self.df.columns)
+
+    def count_rows(self, parent_keys: 'pd.Series') -> 'pd.Series':
+        """统计每条主记录的关联行数"""
+        sizes = {key: len(offsets) for key, offsets in self.index.items()}
+        return parent_keys.map(sizes).fillna(0).astype('int64')
+
+    def get_row_groups(self, parent_keys: Sequence[str], specs: Sequence[PlaceholderSpec]) -> List[List[Dict[str, str]]]:
+        """
+        按主图层关联字段值取出每条记录的关联行
+
+        Args:
+            parent_keys: 每条主记录的关联字段值
+            specs: 引用本关联表的占位符
+
+        Returns:
+            每条主记录对应的关联行列表，每行为 {占位符内容: 值}
+        """
+        missing = [spec.token for spec in specs if spec.column not in self.df.columns]
+        if missing:
+            raise ValueError(f"关联表 {self.name} 中不存在占位符引用的字段: "
+                             + ', '.join(f"!{token}!" for token in missing))
+        columns = {spec.token: format_column(self.df[spec.column], spec.fmt, spec.lookup).tolist()
+                   for spec in specs}
+        empty = np.empty(0, dtype='int64')
+        groups = []
+        for key in parent_keys:
+            offsets = self.index.get(key, empty)
+            groups.append([{token: values[i] for token, values in columns.items()} for i in offsets])
+        return groups
+
+
+class EnrichLayer:
+    """空间关联补充图层，按空间关系把其属性附加到主图层"""
+
+    def __init__(self, path: str, fields: Union[Sequence[str], Dict[str, str]],
+                 predicate: str = 'intersects', how: str = 'largest',
+                 layer: Optional[str] = None, encoding: str = 'gbk'):
+        """
+        初始化补充图层
+
+        Args:
+            path: 图层文件路径
+            fields: 要附加的字段，可为字段名列表，或 {源字段名: 附加后的字段名}
+            predicate: 空间关系，如 intersects（相交）、within（地块位于补充图层要素内）
+            how: 一个地块匹配多个要素时的取舍，largest 取相交面积最大者，first 取第一个
+            layer: 图层名（GeoPackage等多图层数据源）
+            encoding: Shapefile文件编码，默认gbk
+        """
+        if how not in ('largest', 'first'):
+            raise ValueError(f"不支持的匹配方式: {how}")
+        self.path = path
+        self.fields = dict(fields) if isinstance(fields, dict) else {f: f for f in fields}
+        self.predicate = predicate
+        self.how = how
+        self.layer = layer
+        self.encoding = encoding
+
+    def read(self) -> 'gpd.GeoDataFrame':
+        """读取图层中需要的字段"""
+        kwargs = {}
+        if Path(self.path).suffix.lower() in ('.shp', '.dbf'):
+            # 只有Shapefile需要指定编码，GeoPackage等格式自带编码
+            kwargs['encoding'] = self.encoding
+        if self.layer is not None:
+            kwargs['layer'] = self.layer
+        try:
+            gdf = read_vector(self.path, **kwargs)
+        except Exception as e:
+            raise Exception(f"无法读取补充图层 {self.path}: {e}")
+        missing = [f for f in self.fields if f not in gdf.columns]
+        if missing:
+            raise ValueError(f"补充图层 {self.path} 中不存在字段: {', '.join(missing)}")
+        return gdf[list(self.fields) + [gdf.geometry.name]]
+
+
+_ARROW_AVAILABLE: Optional[bool] = None
+
+
+def arrow_available() -> bool:
+    """是否可以通过 pyogrio + pyarrow 以Arrow列式批量读取"""
+    global _ARROW_AVAILABLE
+    if _ARROW_AVAILABLE is None:
+        try:
+            import pyogrio  # noqa: F401
+            import pyarrow  # noqa: F401
+            _ARROW_AVAILABLE = True
+        except ImportError:
+            _ARROW_AVAILABLE = False
+    return _ARROW_AVAILABLE
+
+
+def read_vector(path: str, **kwargs) -> 'gpd.GeoDataFrame':
+    """读取矢量数据，驱动支持时以Arrow列式批量读取，否则使用geopandas默认方式"""
+    if arrow_available():
+        return gpd.read_file(path, engine='pyogrio', use_arrow=True, **kwargs)
+    return gpd.read_file(path, **kwargs)
+
+
+def list_layers(path: str) -> List[str]:
+    """列出多图层数据源（GeoPackage、FileGDB）中的图层名"""
+    try:
+        return [str(name) for name in gpd.list_layers(path)['name']]
+    except AttributeError:
+        import fiona
+        return list(fiona.listlayers(path))
+
+
+class LayerReader(ABC):
+    """
+    图层读取器基类
+
+    子类在 _read() 中把数据读入 self.gdf（GeoDataFrame，不含几何的表格为 DataFrame），
+    字段、记录、几何虚拟字段、关联表和空间关联等功能由基类统一提供。
+    """
+
+    def __init__(self, path: str, target_crs: Any = None):
+        """
+        初始化读取器
+
+        Args:
+            path: 数据文件路径
+            target_crs: 计算几何虚拟字段前投影到的坐标系（如 'EPSG:4527'），为空时使用原坐标系
+        """
+        self.path = path
+        self.target_crs = target_crs
         self.gdf = None
+        self._geometry = None
+        self.related: Dict[str, RelatedTable] = {}
         self._read()
 
+    @abstractmethod
     def _read(self):
-        """读取Shapefile"""
-        try:
-            self.gdf = gpd.read_file(self.shp_path, encoding=self.encoding)
-        except Exception as e:
-            # 尝试其他编码
-            if self.encoding == 'gbk':
-                try:
-                    self.gdf = gpd.read_file(self.shp_path, encoding='utf-8')
-                    self.encoding = 'utf-8'
-                except:
-                    raise Exception(f"无法读取Shapefile: {e}\n请检查文件路径和编码格式")
-            else:
-                raise Exception(f"无法读取Shapefile: {e}")
+        """读取数据到 self.gdf，子类必须实现"""
+
+    @property
+    def is_spatial(self) -> bool:
+        """数据是否包含几何"""
+        return isinstance(self.gdf, gpd.GeoDataFrame) and self.gdf.geometry.name in self.gdf.columns
 
     def get_fields(self) -> List[str]:
         """获取所有字段名"""
@@ -83,125 +366,1124 @@ class ShapefileReader:
         """获取记录数量"""
         return len(self.gdf)
 
-    def get_records(self) -> Iterator[Dict[str, Any]]:
-        """返回记录迭代器"""
-        for idx, row in self.gdf.iterrows():
-            record = {}
-            for col in self.get_fields():
-                value = row[col]
-                # 处理空值
-                if value is None or (hasattr(value, '__class__') and value.__class__.__name__ == 'float' and str(value) == 'nan'):
-                    record[col] = ''
+    def add_related(self, table: RelatedTable):
+        """添加一对多关联表，记录中以关联表名为键附带关联行"""
+        if table.parent_key not in self.gdf.columns:
+            raise ValueError(f"图层中不存在关联字段: {table.parent_key}")
+        self.related[table.name] = table
+
+    def enrich(self, layers: Sequence[EnrichLayer]):
+        """
+        通过空间索引批量关联补充图层，把选定字段附加到图层属性中
+
+        所有补充图层统一投影到主图层几何（即 target_crs）所用的坐标系，
+        匹配对由补充图层的 STRtree 一次性批量查询得到。
+
+        Args:
+            layers: 补充图层列表
+        """
+        import shapely
+
+        geometry = self.get_geometry()
+        parcels = geometry.values
+        count = len(parcels)
+
+        for layer in layers:
+            aux = layer.read()
+            if geometry.crs is not None and aux.crs is not None and aux.crs != geometry.crs:
+                aux = aux.to_crs(geometry.crs)
+            aux_geoms = aux.geometry.values
+
+            # 批量查询: left 为地块序号，right 为补充图层要素序号
+            left, right = aux.sindex.query(parcels, predicate=layer.predicate)
+
+            if len(left) and layer.how == 'largest':
+                # 自相交等无效几何求交会抛出 TopologyException，先修复
+                a = shapely.make_valid(np.asarray(parcels)[left])
+                b = shapely.make_valid(np.asarray(aux_geoms)[right])
+                areas = shapely.area(shapely.intersection(a, b))
+                order = np.lexsort((-areas, left))
+            else:
+                order = np.lexsort((right, left))
+            left, right = left[order], right[order]
+            _, first = np.unique(left, return_index=True)
+            left, right = left[first], right[first]
+
+            for source, target in layer.fields.items():
+                if target in self.gdf.columns:
+                    print(f"  警告: 字段 {target} 已存在，将被补充图层的值覆盖")
+                values = np.full(count, None, dtype=object)
+                values[left] = aux[source].to_numpy(dtype=object)[right]
+                self.gdf[target] = values
+
+    def has_field(self, field: str) -> bool:
+        """判断占位符字段是否可用（图层字段、几何字段、图片或关联表字段）"""
+        if field in GEOMETRY_FIELDS or field in IMAGE_FIELDS:
+            return self.is_spatial
+        if '.' in field:
+            relation, column = field.split('.', 1)
+            return relation in self.related and column in self.related[relation].df.columns
+        return field in self.gdf.columns and field != 'geometry'
+
+    def get_geometry(self) -> 'gpd.GeoSeries':
+        """获取（投影到目标坐标系后的）几何列，投影只进行一次"""
+        if not self.is_spatial:
+            raise ValueError(f"数据源不含几何，无法使用几何字段或位置示意图: {self.path}")
+        if self._geometry is None:
+            geometry = self.gdf.geometry
+            if self.target_crs is not None and geometry.crs is not None:
+                geometry = geometry.to_crs(self.target_crs)
+            self._geometry = geometry
+        return self._geometry
+
+    def _geometry_column(self, spec: PlaceholderSpec) -> 'pd.Series':
+        """按整个几何列计算虚拟字段并格式化"""
+        geometry = self.get_geometry()
+        field = spec.field
+
+        if field in ('_MINX', '_MINY', '_MAXX', '_MAXY', '_BBOX'):
+            bounds = geometry.bounds
+            if field != '_BBOX':
+                return format_column(bounds[field[1:].lower()], spec.fmt, spec.lookup)
+            parts = [format_column(bounds[col], spec.fmt) for col in ('minx', 'miny', 'maxx', 'maxy')]
+            bbox = parts[0].str.cat(parts[1:], sep=',')
+            bbox[geometry.isna() | geometry.is_empty] = ''
+            return bbox
+
+        # 经纬度下的面积/周长是“平方度”，换算成亩、公顷毫无意义
+        if field in MEASURE_FIELDS and geometry.crs is not None and geometry.crs.is_geographic:
+            raise ValueError(f"数据坐标系 {geometry.crs.name} 为地理坐标系（经纬度），无法计算 !{spec.token}!，"
+                             f"请指定投影坐标系（命令行 --target-crs，如 EPSG:4527）")
+
+        if field in ('_CENTROID_X', '_CENTROID_Y'):
+            centroid = geometry.centroid
+            values = centroid.x if field == '_CENTROID_X' else centroid.y
+        elif field == '_PERIMETER':
+            values = geometry.length
+        else:
+            values = geometry.area
+            if field == '_AREA_MU':
+                values = values / SQUARE_METERS_PER_MU
+            elif field == '_AREA_HA':
+                values = values / 10000
+        return format_column(values.where(~geometry.is_empty), spec.fmt, spec.lookup)
+
+    def get_column(self, spec: PlaceholderSpec) -> Optional['pd.Series']:
+        """按占位符计算整列字符串值，关联表字段、图片和不存在的字段返回 None"""
+        if spec.relation is not None or spec.field in IMAGE_FIELDS:
+            return None
+        if spec.field in GEOMETRY_FIELDS:
+            return self._geometry_column(spec) if self.is_spatial else None
+        if spec.field in self.gdf.columns and spec.field != 'geometry':
+            return format_column(self.gdf[spec.field], spec.fmt, spec.lookup)
+        return None
+
+    def get_records(self, specs: Optional[Sequence[PlaceholderSpec]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        返回记录迭代器（整列一次性转换为字符串，空值转为空字符串）
+
+        Args:
+            specs: 模板中的占位符，带格式或对照表的字段和引用到的几何虚拟字段
+                按列计算后以占位符内容为键加入记录
+
+        Returns:
+            记录迭代器
+        """
+        fields = self.get_fields()
+        columns = {col: format_column(self.gdf[col]).tolist() for col in fields}
+
+        relation_specs: Dict[str, List[PlaceholderSpec]] = {}
+        for spec in specs or []:
+            if spec.token in columns:
+                continue
+            if spec.relation is not None:
+                if spec.relation in self.related:
+                    relation_specs.setdefault(spec.relation, []).append(spec)
+                continue
+            values = self.get_column(spec)
+            if values is not None:
+                columns[spec.token] = values.tolist()
+
+        for name, rel_specs in relation_specs.items():
+            table = self.related[name]
+            parent_keys = format_column(self.gdf[table.parent_key]).tolist()
+            columns[name] = table.get_row_groups(parent_keys, rel_specs)
+
+        keys = list(columns)
+        for values in zip(*columns.values()):
+            yield dict(zip(keys, values))
+
+
+class ShapefileReader(LayerReader):
+    """Shapefile读取器"""
+
+    def __init__(self, shp_path: str, encoding: str = 'gbk', target_crs: Any = None):
+        """
+        初始化Shapefile读取器
+
+        Args:
+            shp_path: Shapefile文件路径
+            encoding: 文件编码，默认gbk
+            target_crs: 计算几何虚拟字段前投影到的坐标系（如 'EPSG:4527'），为空时使用原坐标系
+        """
+        self.shp_path = shp_path
+        self.encoding = encoding
+        super().__init__(shp_path, target_crs)
+
+    def _read(self):
+        """读取Shapefile"""
+        try:
+            self.gdf = read_vector(self.shp_path, encoding=self.encoding)
+        except Exception as e:
+            # 尝试其他编码
+            if self.encoding == 'gbk':
+                try:
+                    self.gdf = read_vector(self.shp_path, encoding='utf-8')
+                    self.encoding = 'utf-8'
+                except:
+                    raise Exception(f"无法读取Shapefile: {e}\n请检查文件路径和编码格式")
+            else:
+                raise Exception(f"无法读取Shapefile: {e}")
+
+
+class GeoPackageReader(LayerReader):
+    """GeoPackage读取器，可指定图层"""
+
+    def __init__(self, path: str, layer: Optional[str] = None, target_crs: Any = None):
+        """
+        初始化GeoPackage读取器
+
+        Args:
+            path: 数据源路径
+            layer: 图层名，为空时读取第一个图层
+            target_crs: 计算几何虚拟字段前投影到的坐标系
+        """
+        self.layer = layer
+        super().__init__(path, target_crs)
+
+    def _read(self):
+        """以Arrow列式批量读取图层"""
+        try:
+            kwargs = {'layer': self.layer} if self.layer is not None else {}
+            self.gdf = read_vector(self.path, **kwargs)
+        except Exception as e:
+            raise Exception(f"无法读取图层 {self.layer or ''}: {e}\n请检查文件路径和图层名")
+
+
+class FileGDBReader(GeoPackageReader):
+    """FileGDB读取器（.gdb 目录），可指定图层"""
+
+
+class CSVReader(LayerReader):
+    """CSV表格读取器（不含几何，几何字段和位置示意图不可用）"""
+
+    def __init__(self, path: str, encoding: str = 'utf-8'):
+        """
+        初始化CSV读取器
+
+        Args:
+            path: CSV文件路径
+            encoding: 文件编码，默认utf-8，读取失败时尝试gbk
+        """
+        self.encoding = encoding
+        super().__init__(path)
+
+    def _read(self):
+        """有pyarrow时以Arrow多线程列式解析，否则使用pandas默认解析器；按文本读取以保留编码前导零"""
+        last_error = None
+        for encoding in dict.fromkeys([self.encoding, 'utf-8-sig', 'gbk']):
+            try:
+                if arrow_available():
+                    self.gdf = self._read_arrow(encoding)
                 else:
-                    record[col] = str(value).strip()
-            yield record
+                    self.gdf = pd.read_csv(self.path, encoding=encoding, dtype=str)
+                self.encoding = encoding
+                return
+            except Exception as e:
+                last_error = e
+        raise Exception(f"无法读取CSV: {last_error}\n请检查文件路径和编码格式")
+
+    def _read_arrow(self, encoding: str) -> 'pd.DataFrame':
+        """以pyarrow读取，所有列显式指定为文本类型（避免先推断为数值）"""
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+
+        names = pd.read_csv(self.path, encoding=encoding, nrows=0).columns
+        table = pa_csv.read_csv(
+            self.path,
+            read_options=pa_csv.ReadOptions(encoding=encoding),
+            convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in names})
+        )
+        return table.to_pandas()
+
+
+class ExcelReader(LayerReader):
+    """Excel表格读取器（不含几何，几何字段和位置示意图不可用）"""
+
+    def __init__(self, path: str, sheet: Union[str, int] = 0):
+        """
+        初始化Excel读取器
+
+        Args:
+            path: Excel文件路径
+            sheet: 工作表名或序号，默认第一个工作表
+        """
+        self.sheet = sheet
+        super().__init__(path)
+
+    def _read(self):
+        """读取工作表（Excel驱动不支持Arrow，按pandas方式读取）；按文本读取以保留编码前导零"""
+        try:
+            self.gdf = pd.read_excel(self.path, sheet_name=self.sheet, dtype=str)
+        except Exception as e:
+            raise Exception(f"无法读取Excel: {e}")
+
+
+# 支持的数据源类型: 扩展名 -> 说明
+SUPPORTED_SOURCES = {
+    '.shp': 'Shapefile',
+    '.gpkg': 'GeoPackage',
+    '.gdb': 'FileGDB',
+    '.csv': 'CSV',
+    '.xlsx': 'Excel',
+    '.xls': 'Excel',
+}
+
+
+def open_reader(path: str, layer: Optional[str] = None, encoding: Optional[str] = None,
+                target_crs: Any = None) -> LayerReader:
+    """
+    按扩展名创建对应的读取器
+
+    Args:
+        path: 数据文件路径
+        layer: 图层名（GeoPackage/FileGDB）或工作表名（Excel）
+        encoding: 文件编码（Shapefile/CSV），为空时使用各读取器的默认编码
+        target_crs: 计算几何虚拟字段前投影到的坐标系
+
+    Returns:
+        读取器
+    """
+    suffix = Path(str(path).rstrip('/\\')).suffix.lower()
+    if suffix == '.shp':
+        return ShapefileReader(path, encoding=encoding or 'gbk', target_crs=target_crs)
+    if suffix == '.gpkg':
+        return GeoPackageReader(path, layer=layer, target_crs=target_crs)
+    if suffix == '.gdb':
+        return FileGDBReader(path, layer=layer, target_crs=target_crs)
+    if suffix == '.csv':
+        return CSVReader(path, encoding=encoding or 'utf-8')
+    if suffix in ('.xlsx', '.xls'):
+        return ExcelReader(path, sheet=layer if layer is not None else 0)
+    raise ValueError(f"不支持的数据格式: {suffix or path}（支持: {', '.join(SUPPORTED_SOURCES)}）")
+
+
+# Shapefile由多个文件组成，保存时会依次写入
+SHAPEFILE_PARTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def source_files(path: str) -> List[str]:
+    """数据源实际对应的文件：Shapefile的各组成文件、.gdb目录下的文件、GeoPackage及其WAL文件"""
+    source = Path(path)
+    if source.suffix.lower() == '.shp':
+        return [str(source.with_suffix(suffix)) for suffix in SHAPEFILE_PARTS]
+    if source.is_dir():
+        return [str(p) for p in source.iterdir() if p.is_file()]
+    return [str(source), f"{source}-wal"]
+
+
+def file_snapshot(paths: Sequence[str]) -> Dict[str, Tuple[int, int]]:
+    """文件的 (修改时间, 大小)，不存在的文件不计入，用于判断文件是否变化"""
+    result = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        result[path] = (stat.st_mtime_ns, stat.st_size)
+    return result
 
 
 class TemplateProcessor:
     """Word模板处理器"""
 
-    def __init__(self, template_path: str):
+    def __init__(self, template_path: str, filename_pattern: Optional[str] = None,
+                 lookups: Optional[Dict[str, Dict[str, str]]] = None):
         """
         初始化模板处理器
 
         Args:
             template_path: Word模板文件路径
+            filename_pattern: 输出文件名模式，可使用 {name}（命名字段值）和
+                {template}（模板文件名），为空时由批量生成器决定
+            lookups: 命名对照表 {表名: {代码: 名称}}，占位符中以 !字段|表名! 引用
         """
         self.template_path = template_path
+        self.filename_pattern = filename_pattern
+        self.lookups = lookups or {}
+        self.name = Path(template_path).stem
         self.placeholders = []
-        self._detect_placeholders()
-
-    def _detect_placeholders(self):
-        """检测模板中的所有占位符"""
+        self.specs: Dict[str, PlaceholderSpec] = {}
+        self.repeat_rows: Dict[int, List[Tuple[int, str]]] = {}  # {表格序号: [(行号, 关联表名), ...]}
+        self._template_bytes = b''
+        self.digest = ''  # 模板内容的哈希，用于渲染缓存
+        self._compile()
+
+    def _compile(self):
+        """读取模板并检测其中的所有占位符，模板内容只从磁盘读取一次"""
         try:
-            doc = Document(self.template_path)
-            placeholders = set()
-
-            # 扫描段落
-            for paragraph in doc.paragraphs:
-                matches = re.findall(r'!([A-Za-z0-9_\u4e00-\u9fa5]+)!', paragraph.text)
-                placeholders.update(matches)
-
-            # 扫描表格
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        matches = re.findall(r'!([A-Za-z0-9_\u4e00-\u9fa5]+)!', cell.text)
-                        placeholders.update(matches)
-
-            self.placeholders = list(placeholders)
+            with open(self.template_path, 'rb') as f:
+                self._template_bytes = f.read()
+            self.digest = hashlib.sha256(self._template_bytes).hexdigest()
+            doc = Document(io.BytesIO(self._template_bytes))
+            specs = {}
+            literals = set()  # 格式说明无效、按普通文本保留的 !...! 内容
+
+            for text in self._iter_texts(doc):
+                for match in PLACEHOLDER_PATTERN.finditer(text):
+                    token = match.group(1)
+                    if token in specs or token in literals:
+                        continue
+                    spec = self._parse_spec(match)
+                    if spec is None:
+                        literals.add(token)
+                    else:
+                        specs[token] = spec
+            self.repeat_rows = self._find_repeat_rows(doc, specs)
         except Exception as e:
             raise Exception(f"无法读取Word模板: {e}")
 
+        self.specs = specs
+        self.placeholders = list(dict.fromkeys(spec.field for spec in specs.values()))
+
+    def _parse_spec(self, match: 're.Match') -> Optional[PlaceholderSpec]:
+        """解析单个占位符的格式说明和对照表，格式说明无效时视为普通文本并返回 None"""
+        token, field, fmt, lookup_text = match.groups()
+        lookup = None
+        if lookup_text:
+            if '=' in lookup_text:
+                # 内联对照表: 代码=名称,代码=名称
+                lookup = dict(item.split('=', 1) for item in lookup_text.split(',') if '=' in item)
+            elif lookup_text in self.lookups:
+                lookup = {str(k): str(v) for k, v in self.lookups[lookup_text].items()}
+            else:
+                raise ValueError(f"占位符 !{token}! 引用了未定义的对照表: {lookup_text}")
+        if fmt:
+            error = self._check_format(field, fmt)
+            if error:
+                # 如“注意!联系人:张三!”这样的正文，不是占位符
+                print(f"  警告: !{token}! {error}，按普通文本保留", file=sys.stderr)
+                return None
+        return PlaceholderSpec(token, field, fmt, lookup)
+
+    @staticmethod
+    def _check_format(field: str, fmt: str) -> Optional[str]:
+        """编译时试用格式说明，避免生成时整批失败；有效时返回 None，否则返回原因"""
+        if field in IMAGE_FIELDS:
+            try:
+                float(fmt)
+            except ValueError:
+                return f"的图片宽度不是毫米数: {fmt}"
+            return None
+        if _DATE_SPEC.search(fmt) or _PRINTF_SPEC.match(fmt):
+            return None
+        # 整数列和小数列分别按 int/float 格式化，任一可用即可
+        for sample in (0, 0.0):
+            try:
+                format(sample, fmt)
+                return None
+            except (ValueError, TypeError):
+                pass
+        return f"的格式说明无效: {fmt}"
+
+    @staticmethod
+    def _find_repeat_rows(doc, specs: Dict[str, PlaceholderSpec]) -> Dict[int, List[Tuple[int, str]]]:
+        """找出含关联表占位符的表格行，这些行在渲染时按关联记录重复"""
+        repeat_rows = {}
+        for table_index, table in enumerate(doc.tables):
+            for row_index, row in enumerate(table.rows):
+                text = ''.join(cell.text for cell in row.cells)
+                relations = {specs[m.group(1)].relation for m in PLACEHOLDER_PATTERN.finditer(text)
+                             if m.group(1) in specs} - {None}
+                if len(relations) > 1:
+                    raise ValueError(f"表格第{row_index + 1}行引用了多个关联表: {', '.join(sorted(relations))}")
+                if relations:
+                    repeat_rows.setdefault(table_index, []).append((row_index, relations.pop()))
+        return repeat_rows
+
+    @staticmethod
+    def _iter_texts(doc) -> Iterator[str]:
+        """依次返回段落和表格单元格的文本"""
+        for paragraph in doc.paragraphs:
+            yield paragraph.text
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    yield cell.text
+
     def get_placeholders(self) -> List[str]:
-        """获取所有占位符"""
+        """获取所有占位符引用的字段名"""
         return self.placeholders
 
-    def render(self, data: Dict[str, str], output_path: str) -> bool:
+    def get_specs(self) -> List[PlaceholderSpec]:
+        """获取所有占位符的解析结果"""
+        return list(self.specs.values())
+
+    def _substitute(self, text: str, data: Dict[str, str], relation: Optional[str] = None) -> str:
+        """替换文本中的占位符，数据中不存在的占位符保持原样（重复行中缺失的关联字段置空）"""
+        def replace(match):
+            token = match.group(1)
+            if token in data:
+                return str(data[token])
+            if relation is not None and token in self.specs and match.group(2).startswith(relation + '.'):
+                return ''
+            return match.group(0)
+
+        return PLACEHOLDER_PATTERN.sub(replace, text)
+
+    def _expand_rows(self, doc, data: Dict[str, Any]):
+        """按关联行复制重复行并填充，没有关联行时保留一行空白"""
+        from docx.table import _Row
+
+        for table_index, rows in self.repeat_rows.items():
+            table = doc.tables[table_index]
+            for row_index, relation in reversed(rows):
+                template_row = table.rows[row_index]
+                related_rows = data.get(relation) or [{}]
+                for related in related_rows:
+                    tr = copy.deepcopy(template_row._tr)
+                    template_row._tr.addprevious(tr)
+                    values = dict(data, **related)
+                    for cell in _Row(tr, table).cells:
+                        if '!' in cell.text:
+                            cell.text = self._substitute(cell.text, values, relation)
+                template_row._tr.getparent().remove(template_row._tr)
+
+    def measure(self) -> Tuple[float, int]:
+        """
+        不替换占位符地打开并保存一次模板，用于估算批量生成的耗时和体积
+
+        Returns:
+            (耗时秒数, 文档字节数)
+        """
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        Document(io.BytesIO(self._template_bytes)).save(buffer)
+        return time.perf_counter() - start, buffer.tell()
+
+    def get_image_specs(self) -> List[PlaceholderSpec]:
+        """获取所有图片占位符"""
+        return [spec for spec in self.specs.values() if spec.field in IMAGE_FIELDS]
+
+    def _insert_images(self, paragraph, images: Dict[str, bytes]):
+        """将段落中的图片占位符替换为图片，图片作为媒体部件直接加入文档"""
+        text = paragraph.text
+        if '!' not in text:
+            return
+
+        segments = []
+        last = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            spec = self.specs.get(match.group(1))
+            if spec is None or spec.field not in images:
+                continue
+            segments.append(text[last:match.start()])
+            segments.append(spec)
+            last = match.end()
+        if not segments:
+            return
+        segments.append(text[last:])
+
+        paragraph.text = ''
+        for segment in segments:
+            if isinstance(segment, PlaceholderSpec):
+                width = float(segment.fmt) if segment.fmt else DEFAULT_IMAGE_WIDTH_MM
+                paragraph.add_run().add_picture(io.BytesIO(images[segment.field]), width=Mm(width))
+            elif segment:
+                paragraph.add_run(segment)
+
+    def render(self, data: Dict[str, str], output_path: Union[str, io.BytesIO],
+               images: Optional[Dict[str, bytes]] = None) -> bool:
         """
-        渲染模板并保存
+        渲染模板并保存，失败时在标准错误输出警告
 
         Args:
             data: 占位符数据字典 {字段名: 值}
-            output_path: 输出文件路径
+            output_path: 输出文件路径，或写入文档内容的内存缓冲区
+            images: 图片数据 {图片字段名: PNG数据}
 
         Returns:
             bool: 是否成功
         """
+        error = self.try_render(data, output_path, images)
+        if error is not None:
+            print(f"  警告: 渲染失败 - {error}", file=sys.stderr)
+        return error is None
+
+    def try_render(self, data: Dict[str, str], output_path: Union[str, io.BytesIO],
+                   images: Optional[Dict[str, bytes]] = None) -> Optional[str]:
+        """
+        渲染模板并保存，不输出警告
+
+        Returns:
+            错误信息，成功时为 None
+        """
         try:
-            doc = Document(self.template_path)
+            doc = Document(io.BytesIO(self._template_bytes))
 
             # 替换段落中的占位符
             for paragraph in doc.paragraphs:
-                for key, value in data.items():
-                    placeholder = f'!{key}!'
-                    if placeholder in paragraph.text:
-                        paragraph.text = paragraph.text.replace(placeholder, str(value))
+                if '!' in paragraph.text:
+                    text = self._substitute(paragraph.text, data)
+                    if text != paragraph.text:
+                        paragraph.text = text
+
+            # 展开关联表重复行
+            if self.repeat_rows:
+                self._expand_rows(doc, data)
 
             # 替换表格中的占位符
             for table in doc.tables:
                 for row in table.rows:
                     for cell in row.cells:
-                        for key, value in data.items():
-                            placeholder = f'!{key}!'
-                            if placeholder in cell.text:
-                                cell.text = cell.text.replace(placeholder, str(value))
-
-            # 保存文档
+                        if '!' in cell.text:
+                            text = self._substitute(cell.text, data)
+                            if text != cell.text:
+                                cell.text = text
+
+            # 插入图片
+            if images:
+                for paragraph in doc.paragraphs:
+                    self._insert_images(paragraph, images)
+                for table in doc.tables:
+                    for row in table.rows:
+                        for cell in row.cells:
+                            for paragraph in cell.paragraphs:
+                                self._insert_images(paragraph, images)
+
+            # 保存文档（与渲染缓存硬链接的旧文件先删除，避免覆盖共享的内容）
+            if isinstance(output_path, str) and os.path.exists(output_path) and os.stat(output_path).st_nlink > 1:
+                os.remove(output_path)
             doc.save(output_path)
-            return True
+            return None
 
         except Exception as e:
-            print(f"  警告: 渲染失败 - {e}")
+            return str(e) or type(e).__name__
+
+
+class MapRenderer:
+    """地块位置示意图渲染器（无界面绘制，所有记录复用同一画布）"""
+
+    def __init__(self, geometry: 'gpd.GeoSeries', size: Tuple[int, int] = (400, 300), dpi: int = 100,
+                 margin: float = 0.3, show_neighbors: bool = True):
+        """
+        初始化渲染器
+
+        Args:
+            geometry: 几何列，按记录顺序排列
+            size: 图片尺寸（像素）
+            dpi: 分辨率
+            margin: 地块四周留白，占地块范围的比例
+            show_neighbors: 是否通过空间索引绘制视图范围内的相邻图斑
+        """
+        self.geometry = geometry.reset_index(drop=True)
+        self.size = size
+        self.dpi = dpi
+        self.margin = margin
+        self.show_neighbors = show_neighbors
+        self._figure = None
+        self._axes = None
+        self._artists = []
+
+    def __getstate__(self):
+        # 画布不随对象传入工作进程，由各进程首次绘制时自行创建
+        state = self.__dict__.copy()
+        state.update(_figure=None, _axes=None, _artists=[])
+        return state
+
+    def _canvas(self):
+        """创建并复用同一个画布"""
+        if self._figure is None:
+            try:
+                from matplotlib.figure import Figure
+                from matplotlib.backends.backend_agg import FigureCanvasAgg
+            except ImportError as e:
+                raise ImportError(f"绘制位置示意图需要matplotlib，请运行: pip install matplotlib\n详细信息: {e}")
+
+            width, height = self.size
+            self._figure = Figure(figsize=(width / self.dpi, height / self.dpi), dpi=self.dpi)
+            FigureCanvasAgg(self._figure)
+            self._axes = self._figure.add_axes((0, 0, 1, 1))
+            self._axes.set_axis_off()
+        return self._figure, self._axes
+
+    @staticmethod
+    def _to_path(geometries) -> Any:
+        """将多个面/线几何合并为一条 matplotlib 复合路径"""
+        import shapely
+        from matplotlib.path import Path as MplPath
+
+        vertices, codes = [], []
+        for part in shapely.get_parts(np.asarray(geometries, dtype=object)):
+            rings = shapely.get_rings(part) if part.geom_type == 'Polygon' else [part]
+            for ring in rings:
+                coords = shapely.get_coordinates(ring)
+                if len(coords) < 2:
+                    continue
+                ring_codes = np.full(len(coords), MplPath.LINETO, dtype=MplPath.code_type)
+                ring_codes[0] = MplPath.MOVETO
+                if part.geom_type == 'Polygon':
+                    ring_codes[-1] = MplPath.CLOSEPOLY
+                vertices.append(coords)
+                codes.append(ring_codes)
+        if not vertices:
+            return None
+        return MplPath(np.concatenate(vertices), np.concatenate(codes))
+
+    def render(self, position: int) -> bytes:
+        """
+        绘制第 position 条记录的位置示意图
+
+        Returns:
+            PNG数据
+        """
+        from matplotlib.patches import PathPatch
+
+        figure, axes = self._canvas()
+        for artist in self._artists:
+            artist.remove()
+        self._artists = []
+
+        geom = self.geometry.iloc[position]
+        if geom is not None and not geom.is_empty:
+            # 视图范围按图片宽高比扩展，保证横纵比例一致
+            minx, miny, maxx, maxy = geom.bounds
+            width, height = self.size
+            half_w = max(maxx - minx, (maxy - miny) * width / height, 1e-9) * (0.5 + self.margin)
+            half_h = half_w * height / width
+            cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+            view = (cx - half_w, cy - half_h, cx + half_w, cy + half_h)
+
+            if self.show_neighbors:
+                from shapely.geometry import box
+                nearby = self.geometry.sindex.query(box(*view), predicate='intersects')
+                nearby = nearby[nearby != position]
+                path = self._to_path(self.geometry.values[nearby]) if len(nearby) else None
+                if path is not None:
+                    self._artists.append(axes.add_patch(
+                        PathPatch(path, facecolor='#e6e6e6', edgecolor='#8c8c8c', linewidth=0.5)))
+
+            path = self._to_path([geom])
+            if path is not None:
+                self._artists.append(axes.add_patch(
+                    PathPatch(path, facecolor='#ff000040', edgecolor='#d40000', linewidth=1.2)))
+            axes.set_xlim(view[0], view[2])
+            axes.set_ylim(view[1], view[3])
+
+        # 直接从复用的画布取像素并用低压缩级别编码，避免 savefig 每次重建渲染器
+        from PIL import Image
+
+        canvas = figure.canvas
+        canvas.draw()
+        image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        buffer = io.BytesIO()
+        image.save(buffer, format='png', compress_level=1)
+        return buffer.getvalue()
+
+
+class RenderCache:
+    """
+    内容寻址的渲染缓存
+
+    以 (模板内容, 模板引用到的占位符的值) 的哈希作为键，内容相同的文档只渲染一次，
+    其余记录直接硬链接（不支持时复制）到缓存中的文档。缓存目录可在多次运行间共用。
+    含位置示意图的模板每条记录的图片不同，不使用缓存。
+    """
+
+    VERSION = b'survey-render-cache-1'
+
+    def __init__(self, directory: str, link: bool = True):
+        """
+        初始化渲染缓存
+
+        Args:
+            directory: 缓存目录
+            link: 是否使用硬链接放置文档，False 或硬链接失败（如跨磁盘）时复制
+        """
+        self.directory = directory
+        self.link = link
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, template: TemplateProcessor, record: Dict[str, Any]) -> Optional[str]:
+        """计算缓存键，模板含图片时返回 None"""
+        if template.get_image_specs():
+            return None
+        h = hashlib.sha256(self.VERSION)
+        h.update(template.digest.encode('ascii'))
+        for token in sorted(template.specs):
+            spec = template.specs[token]
+            value = record.get(spec.relation) if spec.relation is not None else record.get(token)
+            h.update(json.dumps([token, value], ensure_ascii=False, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        """缓存文档的路径"""
+        return os.path.join(self.directory, key[:2], f"{key}.docx")
+
+    def has(self, key: str) -> bool:
+        """缓存中是否已有该文档"""
+        return os.path.exists(self.path(key))
+
+    def _link_or_copy(self, source: str, target: str):
+        if self.link:
+            try:
+                os.link(source, target)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(source, target)
+
+    def store(self, key: str, output_path: str):
+        """把刚渲染的文档加入缓存（先写临时文件再替换，不会留下不完整的缓存文件）"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        self._link_or_copy(output_path, temp_path)
+        os.replace(temp_path, path)
+
+    def place(self, key: str, output_path: str) -> bool:
+        """把缓存中的文档放到输出路径，缓存中没有时返回 False"""
+        path = self.path(key)
+        if not os.path.exists(path):
             return False
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        self._link_or_copy(path, output_path)
+        return True
+
+
+class ProgressEvent(NamedTuple):
+    """
+    生成过程事件
+
+    kind 取值：
+        started        开始生成，total 为文档总数
+        batch          一批文档完成（按时间或数量节流）
+        record_failed  文档渲染失败，detail 为 {'filename', 'error'}
+        stage          阶段耗时，detail 为 {'stage', 'seconds'}
+        finished       生成结束，detail 为 {'success', 'failed'} 文档数
+    """
+    kind: str
+    done: int = 0
+    total: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    detail: Optional[Dict[str, Any]] = None
+
+
+ProgressListener = Callable[[ProgressEvent], None]
+
+
+class ProgressEmitter:
+    """
+    事件分发器：把生成过程事件发送给各监听者
+
+    完成进度（batch）按时间间隔或完成数量节流，每秒上千条记录时也只发送少量事件；
+    开始、失败、阶段耗时和结束事件总是立即发送。
+    """
+
+    def __init__(self, listeners: Optional[Sequence[ProgressListener]] = None,
+                 interval: float = 0.2, every: Optional[int] = None):
+        """
+        初始化事件分发器
+
+        Args:
+            listeners: 监听者列表，每个监听者是接收 ProgressEvent 的可调用对象
+            interval: 两次进度事件之间的最短间隔（秒）
+            every: 完成数量每增加多少发送一次进度事件，为空时只按时间节流
+        """
+        self.listeners = list(listeners or [])
+        self.interval = interval
+        self.every = every
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self._start = 0.0
+        self._last_time = 0.0
+        self._last_done = 0
+
+    def _emit(self, kind: str, detail: Optional[Dict[str, Any]] = None):
+        event = ProgressEvent(kind, self.done, self.total, self.failed,
+                              time.perf_counter() - self._start, detail)
+        for listener in self.listeners:
+            listener(event)
+
+    def started(self, total: int):
+        """开始生成"""
+        self.total, self.done, self.failed = total, 0, 0
+        self._start = self._last_time = time.perf_counter()
+        self._last_done = 0
+        self._emit('started')
+
+    def advance(self, outcome: Sequence[Tuple[str, bool, Optional[str]]]):
+        """一条记录完成，outcome 为 [(输出路径, 是否成功, 错误信息), ...]"""
+        for output_path, success, error in outcome:
+            self.done += 1
+            if not success:
+                self.failed += 1
+                self._emit('record_failed', {'filename': Path(output_path).stem, 'error': error or '渲染失败'})
+
+        if time.perf_counter() - self._last_time >= self.interval or \
+                (self.every and self.done - self._last_done >= self.every):
+            self.flush()
+
+    def flush(self):
+        """立即发送尚未发送的进度"""
+        if self.done == self._last_done:
+            return
+        self._last_time, self._last_done = time.perf_counter(), self.done
+        self._emit('batch')
+
+    def stage(self, name: str, seconds: float):
+        """阶段耗时"""
+        self._emit('stage', {'stage': name, 'seconds': round(seconds, 3)})
+
+    def finished(self):
+        """生成结束，先补发最后一批进度"""
+        self.flush()
+        self._emit('finished', {'success': self.done - self.failed, 'failed': self.failed})
+
+
+class TqdmProgress:
+    """以 tqdm 进度条显示生成进度（命令行默认）"""
+
+    def __init__(self, desc: str = "生成进度"):
+        self.desc = desc
+        self.bar = None
+
+    def __call__(self, event: ProgressEvent):
+        if event.kind == 'started':
+            print(f"\n正在生成文档...")
+            self.bar = tqdm(total=event.total, desc=self.desc)
+        elif self.bar is None:
+            return
+        elif event.kind == 'batch':
+            self.bar.update(event.done - self.bar.n)
+        elif event.kind == 'finished':
+            self.bar.update(event.done - self.bar.n)
+            self.bar.close()
+            self.bar = None
+
+
+class JsonLinesProgress:
+    """把事件逐行写成JSON，供脚本和其他程序读取"""
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream
+
+    def __call__(self, event: ProgressEvent):
+        stream = self.stream or sys.stdout
+        data = event._asdict()
+        data['elapsed'] = round(data['elapsed'], 3)
+        stream.write(json.dumps(data, ensure_ascii=False) + '\n')
+        stream.flush()
+
+
+# 工作进程中共享的模板列表和示意图渲染器，由 _init_worker 在进程启动时设置一次
+_WORKER_TEMPLATES: List[TemplateProcessor] = []
+_WORKER_RENDERER: Optional[MapRenderer] = None
+
+
+def _init_worker(templates: List[TemplateProcessor], renderer: Optional[MapRenderer] = None):
+    """工作进程初始化：接收已编译的模板和示意图渲染器"""
+    global _WORKER_TEMPLATES, _WORKER_RENDERER
+    _WORKER_TEMPLATES = templates
+    _WORKER_RENDERER = renderer
+
+
+def _draw_images(position: int, renderer: Optional[MapRenderer]) -> Tuple[Dict[str, bytes], Optional[str]]:
+    """
+    绘制一条记录的图片（位置示意图）
+
+    Returns:
+        (图片数据 {图片字段名: PNG数据}, 错误信息)，成功时错误信息为 None
+    """
+    if renderer is None:
+        return {}, "示意图绘制失败: 没有可用的示意图渲染器"
+    try:
+        return {'_MAP': renderer.render(position)}, None
+    except Exception as e:
+        return {}, f"示意图绘制失败: {e}"
+
+
+def _render_record(job: Tuple[int, Dict[str, str], List[Tuple[int, str]]],
+                   templates: Optional[List[TemplateProcessor]] = None,
+                   renderer: Optional[MapRenderer] = None) -> List[Tuple[str, bool, Optional[str]]]:
+    """
+    将一条记录渲染到所有目标模板，示意图每条记录只绘制一次
+
+    Args:
+        job: (记录序号, 记录, [(模板序号, 输出路径), ...])
+        templates: 模板列表，为空时使用工作进程中的模板
+        renderer: 示意图渲染器，为空时使用工作进程中的渲染器
+
+    Returns:
+        [(输出路径, 是否成功, 错误信息), ...]
+    """
+    if templates is None:
+        templates, renderer = _WORKER_TEMPLATES, _WORKER_RENDERER
+    position, record, targets = job
+
+    images, image_error = {}, None
+    if any(templates[index].get_image_specs() for index, _ in targets):
+        images, image_error = _draw_images(position, renderer)
+
+    outcome = []
+    for index, output_path in targets:
+        # 示意图绘制失败时不生成带有未替换占位符的文档
+        if image_error is not None and templates[index].get_image_specs():
+            outcome.append((output_path, False, image_error))
+            continue
+        error = templates[index].try_render(record, output_path, images)
+        outcome.append((output_path, error is None, error))
+    return outcome
+
+
+def _render_document(job: Tuple[int, Dict[str, str], int],
+                     templates: Optional[List[TemplateProcessor]] = None,
+                     renderer: Optional[MapRenderer] = None) -> Optional[bytes]:
+    """
+    将一条记录渲染到一个模板，返回文档内容而不写入文件
+
+    Args:
+        job: (记录序号, 记录, 模板序号)
+        templates: 模板列表，为空时使用工作进程中的模板
+        renderer: 示意图渲染器，为空时使用工作进程中的渲染器
+
+    Returns:
+        docx文档内容，渲染失败时返回 None
+    """
+    if templates is None:
+        templates, renderer = _WORKER_TEMPLATES, _WORKER_RENDERER
+    position, record, index = job
+
+    images = {}
+    if templates[index].get_image_specs():
+        images, error = _draw_images(position, renderer)
+        if error is not None:
+            print(f"  警告: {error}", file=sys.stderr)
+            return None
+
+    buffer = io.BytesIO()
+    if not templates[index].render(record, buffer, images):
+        return None
+    return buffer.getvalue()
 
 
 class BatchGenerator:
     """批量生成器"""
 
-    def __init__(self, shp_reader: ShapefileReader, template_processor: TemplateProcessor):
+    def __init__(self, shp_reader: LayerReader,
+                 template_processor: Union[TemplateProcessor, Sequence[TemplateProcessor]],
+                 workers: int = 1, map_renderer: Optional[MapRenderer] = None,
+                 render_cache: Optional[RenderCache] = None):
         """
         初始化批量生成器
 
         Args:
-            shp_reader: Shapefile读取器
-            template_processor: 模板处理器
+            shp_reader: 图层读取器
+            template_processor: 模板处理器，或多个模板处理器组成的列表
+                （每条记录只解码一次，依次渲染到所有模板）
+            workers: 渲染进程数，1表示在当前进程中顺序渲染
+            map_renderer: 位置示意图渲染器，为空且模板引用 !_MAP! 时自动创建
+            render_cache: 渲染缓存，内容相同的文档只渲染一次，为空时每个文档都渲染
         """
         self.shp_reader = shp_reader
-        self.template_processor = template_processor
+        if isinstance(template_processor, TemplateProcessor):
+            self.templates = [template_processor]
+        else:
+            self.templates = list(template_processor)
+        if not self.templates:
+            raise ValueError("至少需要一个模板")
+        self.template_processor = self.templates[0]
+        self.workers = max(1, workers)
+        self.map_renderer = map_renderer
+        if self.map_renderer is None and any(t.get_image_specs() for t in self.templates):
+            self.map_renderer = MapRenderer(self.shp_reader.get_geometry())
+        self.render_cache = render_cache
         self.filename_counter = {}  # 跟踪文件名使用次数，处理冲突
 
-    def generate_all(self, output_dir: str, naming_field: str) -> Dict[str, Any]:
+    def _collect_specs(self) -> List[PlaceholderSpec]:
+        """汇总所有模板中的占位符"""
+        specs = {}
+        for template in self.templates:
+            for spec in template.get_specs():
+                specs.setdefault(spec.token, spec)
+        return list(specs.values())
+
+    def _filename_pattern(self, template: TemplateProcessor) -> str:
+        """获取模板的文件名模式，多模板时默认附加模板名以免互相覆盖"""
+        if template.filename_pattern:
+            return template.filename_pattern
+        return '{name}' if len(self.templates) == 1 else '{name}_{template}'
+
+    def _plan_record(self, name: str) -> List[str]:
+        """为一条记录的每个模板分配唯一的文件名（不含扩展名）"""
+        name = self._sanitize_filename(name)
+        filenames = []
+        for template in self.templates:
+            pattern = self._filename_pattern(template)
+            base_filename = self._sanitize_filename(pattern.format(name=name, template=template.name))
+            filenames.append(self._get_unique_filename(base_filename))
+        return filenames
+
+    def _naming_values(self, naming_field: str) -> List[str]:
+        """命名字段的值（与记录中的值一致），字段不存在时为 unnamed"""
+        reader = self.shp_reader
+        if naming_field in reader.gdf.columns:
+            return format_column(reader.gdf[naming_field]).tolist()
+        return ['unnamed'] * reader.get_record_count()
+
+    def reserve_filenames(self, naming_field: str) -> List[List[str]]:
+        """
+        文件名预留：按记录顺序为全部记录分配文件名
+
+        计数器每次重新开始，只依赖记录顺序和命名字段值，因此各分片
+        分别预留或共用同一份预留结果，得到的序号后缀都是全局一致的。
+
+        Args:
+            naming_field: 用于命名字段
+
+        Returns:
+            每条记录在各模板下的文件名（不含扩展名）
+        """
+        self.filename_counter = {}
+        return [self._plan_record(name) for name in self._naming_values(naming_field)]
+
+    def generate_all(self, output_dir: str, naming_field: str,
+                     shard: Optional[Tuple[int, int]] = None, shard_key: Optional[str] = None,
+                     reservation: Optional[List[List[str]]] = None,
+                     positions: Optional[Sequence[int]] = None,
+                     progress: Union[ProgressEmitter, Sequence[ProgressListener], None] = None) -> Dict[str, Any]:
         """
         批量生成所有文档
 
         Args:
             output_dir: 输出目录
             naming_field: 用于命名字段
+            shard: 分片 (序号, 分片数)，序号从1开始，为空时生成全部记录
+            shard_key: 分片依据的字段，默认使用命名字段
+            reservation: 文件名预留结果（见 reserve_filenames），为空时在本地预留
+            positions: 只生成这些序号的记录（文件名仍按全部记录预留），优先于分片
+            progress: 事件分发器或监听者列表，为空时显示 tqdm 进度条
 
         Returns:
             生成结果统计
         """
+        if not isinstance(progress, ProgressEmitter):
+            progress = ProgressEmitter([TqdmProgress()] if progress is None else progress)
+        prepare_start = time.perf_counter()
+
         # 创建输出目录
         os.makedirs(output_dir, exist_ok=True)
 
@@ -211,35 +1493,213 @@ class BatchGenerator:
             'total': 0
         }
 
-        # 获取所有记录
-        records = list(self.shp_reader.get_records())
-        results['total'] = len(records)
+        # 为全部记录预留文件名（在主进程中按记录顺序进行，保证序号稳定）
+        if reservation is None:
+            reservation = self.reserve_filenames(naming_field)
+        elif len(reservation) != self.shp_reader.get_record_count():
+            raise ValueError(f"文件名预留的记录数({len(reservation)})与数据记录数"
+                             f"({self.shp_reader.get_record_count()})不一致，请重新预留")
+
+        selected = None
+        if positions is not None:
+            selected = set(positions)
+        elif shard is not None:
+            selected = set(self.shard_positions(shard, shard_key or naming_field))
+
+        jobs = []
+        for position, record in enumerate(self.shp_reader.get_records(self._collect_specs())):
+            if selected is not None and position not in selected:
+                continue
+            targets = [(index, os.path.join(output_dir, f"{filename}.docx"))
+                       for index, filename in enumerate(reservation[position])]
+            jobs.append((position, record, targets))
+        results['total'] = len(jobs) * len(self.templates)
+
+        progress.started(results['total'])
+
+        def collect(outcome):
+            for output_path, success, error in outcome:
+                filename = Path(output_path).stem
+                if success:
+                    results['success'].append(filename)
+                else:
+                    results['failed'].append((filename, error or '渲染失败'))
+            progress.advance(outcome)
 
-        print(f"\n正在生成文档...")
+        # 渲染缓存：已缓存的文档直接放置，本次重复的文档等第一份渲染完成后放置
+        cache = self.render_cache
+        output_keys, duplicates = {}, []
+        if cache is not None:
+            jobs, output_keys, duplicates = self._dedupe_jobs(jobs, collect)
+        progress.stage('prepare', time.perf_counter() - prepare_start)
 
         # 批量生成
-        for record in tqdm(records, desc="生成进度"):
-            try:
-                # 生成基础文件名
-                base_filename = self._sanitize_filename(str(record.get(naming_field, 'unnamed')))
+        render_start = time.perf_counter()
+        for outcome in self._run_jobs(jobs):
+            if cache is not None:
+                for output_path, success, _ in outcome:
+                    if success and output_path in output_keys:
+                        cache.store(output_keys[output_path], output_path)
+            collect(outcome)
+        progress.flush()
+        progress.stage('render', time.perf_counter() - render_start)
+
+        if duplicates:
+            place_start = time.perf_counter()
+            for key, output_path in duplicates:
+                collect([self._place_cached(key, output_path)])
+            progress.flush()
+            progress.stage('place', time.perf_counter() - place_start)
+        progress.finished()
 
-                # 获取唯一文件名（处理冲突）
-                filename = self._get_unique_filename(base_filename)
-                output_path = os.path.join(output_dir, f"{filename}.docx")
+        return results
 
-                # 渲染文档
-                success = self.template_processor.render(record, output_path)
+    def _dedupe_jobs(self, jobs: List[Tuple[int, Dict[str, str], List[Tuple[int, str]]]],
+                     collect: Callable[[List[Tuple[str, bool, Optional[str]]]], None]):
+        """
+        按渲染缓存键去除重复的渲染任务
 
-                if success:
-                    results['success'].append(filename)
+        Args:
+            jobs: 渲染任务
+            collect: 结果回调，缓存中已有的文档放置后立即报告
+
+        Returns:
+            (需要渲染的任务, {输出路径: 缓存键}, [(缓存键, 输出路径), ...] 本次运行中重复、待放置的文档)
+        """
+        cache = self.render_cache
+        pending, output_keys, duplicates = set(), {}, []
+        remaining = []
+        for position, record, targets in jobs:
+            render_targets = []
+            for index, output_path in targets:
+                key = cache.key(self.templates[index], record)
+                if key is None:
+                    render_targets.append((index, output_path))
+                elif key in pending:
+                    duplicates.append((key, output_path))
+                elif cache.has(key):
+                    collect([self._place_cached(key, output_path)])
                 else:
-                    results['failed'].append((filename, '渲染失败'))
+                    pending.add(key)
+                    output_keys[output_path] = key
+                    render_targets.append((index, output_path))
+            if render_targets:
+                remaining.append((position, record, render_targets))
+        return remaining, output_keys, duplicates
+
+    def _place_cached(self, key: str, output_path: str) -> Tuple[str, bool, Optional[str]]:
+        """从渲染缓存放置文档，返回与渲染任务相同格式的结果"""
+        try:
+            if self.render_cache.place(key, output_path):
+                return output_path, True, None
+            return output_path, False, "缓存文件不存在（相同内容的文档渲染失败）"
+        except OSError as e:
+            return output_path, False, str(e)
 
-            except Exception as e:
-                filename = str(record.get(naming_field, 'unknown'))
-                results['failed'].append((filename, str(e)))
+    def shard_positions(self, shard: Tuple[int, int], shard_key: str) -> List[int]:
+        """
+        按分片字段值的稳定哈希划分记录，返回属于该分片的记录序号
 
-        return results
+        使用 md5 而不是内置 hash()，保证不同机器、不同进程的划分结果一致。
+
+        Args:
+            shard: (序号, 分片数)，序号从1开始
+            shard_key: 分片依据的字段
+
+        Returns:
+            记录序号列表
+        """
+        index, count = shard
+        if not 1 <= index <= count:
+            raise ValueError(f"分片序号应在 1-{count} 之间: {index}")
+        if shard_key not in self.shp_reader.gdf.columns:
+            raise ValueError(f"分片字段不存在: {shard_key}")
+
+        keys = format_column(self.shp_reader.gdf[shard_key]).tolist()
+        return [position for position, key in enumerate(keys)
+                if int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big') % count == index - 1]
+
+    def plan(self, output_dir: str, naming_field: str) -> Dict[str, Any]:
+        """
+        试运行：不渲染文档，按列统计占位符匹配、空值和文件名情况，并给出文件名计划
+
+        Args:
+            output_dir: 输出目录
+            naming_field: 用于命名字段
+
+        Returns:
+            检查报告
+        """
+        reader = self.shp_reader
+        count = reader.get_record_count()
+        report = {
+            'total_records': count,
+            'total_documents': count * len(self.templates),
+            'missing_placeholders': {},
+            'empty_placeholders': {},
+            'records_with_empty': 0,
+            'naming_collisions': {},
+            'unnamed': 0,
+            'filenames': [],
+            'estimated_bytes': 0,
+            'estimated_seconds': 0.0,
+        }
+
+        # 未匹配字段的占位符
+        for template in self.templates:
+            missing = [spec.token for spec in template.get_specs() if not reader.has_field(spec.field)]
+            if missing:
+                report['missing_placeholders'][template.name] = missing
+
+        # 各占位符的空值数量（关联表占位符统计没有关联行的记录数）
+        any_empty = pd.Series(False, index=range(count))
+        for spec in self._collect_specs():
+            if spec.relation is not None and spec.relation in reader.related:
+                table = reader.related[spec.relation]
+                parent_keys = format_column(reader.gdf[table.parent_key]).reset_index(drop=True)
+                empty = table.count_rows(parent_keys) == 0
+            else:
+                values = reader.get_column(spec)
+                if values is None:
+                    continue
+                empty = values.reset_index(drop=True) == ''
+            empty_count = int(empty.sum())
+            if empty_count:
+                report['empty_placeholders'][spec.token] = empty_count
+                any_empty |= empty
+        report['records_with_empty'] = int(any_empty.sum())
+
+        # 清理后为空（将命名为 unnamed）的记录，以及清理后重名的文件名
+        # （与 _sanitize_filename 一致：A/B 与 A_B、前200个字符相同的长名称都会重名）
+        names = pd.Series(self._naming_values(naming_field), dtype=object)
+        cleaned = names.str.replace(_ILLEGAL_FILENAME_CHARS, '_', regex=True).str.strip().str[:200]
+        report['unnamed'] = int((cleaned == '').sum())
+        counts = cleaned.replace('', 'unnamed').value_counts()
+        report['naming_collisions'] = {str(k): int(v) for k, v in counts[counts > 1].items()}
+
+        # 文件名计划，与 generate_all 使用相同的文件名预留
+        for filenames in self.reserve_filenames(naming_field):
+            report['filenames'].extend(os.path.join(output_dir, f"{filename}.docx") for filename in filenames)
+
+        # 以一次不替换的打开/保存估算耗时和体积（不含位置示意图）
+        for template in self.templates:
+            seconds, size = template.measure()
+            report['estimated_bytes'] += size * count
+            report['estimated_seconds'] += seconds * count / self.workers
+
+        return report
+
+    def _run_jobs(self, jobs: List[Tuple[int, Dict[str, str], List[Tuple[int, str]]]]) -> Iterator[List[Tuple[str, bool, Optional[str]]]]:
+        """按记录顺序执行渲染任务，多进程时各进程共享同一份已编译模板和渲染器"""
+        if self.workers == 1 or len(jobs) < 2:
+            for job in jobs:
+                yield _render_record(job, self.templates, self.map_renderer)
+            return
+
+        chunksize = max(1, len(jobs) // (self.workers * 8))
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.templates, self.map_renderer)) as executor:
+            yield from executor.map(_render_record, jobs, chunksize=chunksize)
 
     def _sanitize_filename(self, filename: str) -> str:
         """
@@ -252,7 +1712,7 @@ class BatchGenerator:
             清理后的文件名
         """
         # 移除Windows非法字符
-        cleaned = re.sub(r'[<>:"/\\|?*]', '_', filename)
+        cleaned = re.sub(_ILLEGAL_FILENAME_CHARS, '_', filename)
         cleaned = cleaned.strip()
 
         # 限制长度
@@ -286,6 +1746,252 @@ class BatchGenerator:
             return f"{base_filename}_{count}"
 
 
+class BatchWatcher:
+    """
+    监视模式：监视数据文件和模板，变化时只重新生成受影响的文档
+
+    记录按 关键字段值（重复值附加出现次序）区分，以整行的值哈希判断是否修改；
+    模板变化时重新生成全部文档。状态保存在输出目录中，重启后仍只生成有变化的记录。
+    """
+
+    STATE_FILE = '.watch_state.json'
+
+    def __init__(self, source: str, template_paths: Sequence[str], output_dir: str, naming_field: str,
+                 key_field: Optional[str] = None, layer: Optional[str] = None, encoding: Optional[str] = None,
+                 target_crs: Any = None, workers: int = 1, interval: float = 1.0, debounce: float = 2.0,
+                 progress: Optional[Sequence[ProgressListener]] = None, render_cache: Optional[str] = None,
+                 log: Optional[TextIO] = None):
+        """
+        初始化监视器
+
+        Args:
+            source: 数据文件路径
+            template_paths: 模板路径列表
+            output_dir: 输出目录
+            naming_field: 用于命名字段
+            key_field: 区分记录的关键字段，默认使用命名字段
+            layer: 图层名（GeoPackage/FileGDB）或工作表名（Excel）
+            encoding: 文件编码
+            target_crs: 计算几何虚拟字段前投影到的坐标系
+            workers: 渲染进程数
+            interval: 检查文件变化的间隔（秒）
+            debounce: 文件停止变化多久后才开始生成（秒），避免多文件保存过程中读到不完整的数据
+            progress: 每次生成时的进度监听者，为空时显示 tqdm 进度条
+            render_cache: 渲染缓存目录，为空时不使用缓存
+            log: 状态信息的输出流，为空时输出到标准输出（JSON进度模式下应为标准错误）
+        """
+        self.source = source
+        self.template_paths = list(template_paths)
+        self.output_dir = output_dir
+        self.naming_field = naming_field
+        self.key_field = key_field or naming_field
+        self.layer = layer
+        self.encoding = encoding
+        self.target_crs = target_crs
+        self.workers = workers
+        self.interval = interval
+        self.debounce = debounce
+        self.progress = progress
+        self.render_cache = RenderCache(render_cache) if render_cache else None
+        self.log = log
+        self.state_path = os.path.join(output_dir, self.STATE_FILE)
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict[str, Any]:
+        """读取上次运行的状态"""
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'templates': {}, 'records': {}}
+
+    def _save_state(self):
+        """保存状态"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+
+    def watched_files(self) -> List[str]:
+        """需要监视的文件：数据文件（含Shapefile的各组成文件、.gdb目录下的文件）和模板"""
+        return source_files(self.source) + self.template_paths
+
+    def snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """监视文件的 (修改时间, 大小)"""
+        return file_snapshot(self.watched_files())
+
+    @staticmethod
+    def record_hashes(reader: LayerReader, key_field: str) -> Tuple[List[str], List[str]]:
+        """
+        按列计算每条记录的关键字和值哈希
+
+        Returns:
+            (关键字列表, 值哈希列表)
+        """
+        if key_field not in reader.gdf.columns:
+            raise ValueError(f"关键字段不存在: {key_field}")
+
+        values = pd.DataFrame({col: format_column(reader.gdf[col]) for col in reader.get_fields()})
+        if reader.is_spatial:
+            values['__geometry__'] = reader.gdf.geometry.to_wkb(hex=True).fillna('')
+        hashes = pd.util.hash_pandas_object(values.reset_index(drop=True), index=False)
+
+        keys = values[key_field].reset_index(drop=True)
+        occurrence = keys.groupby(keys).cumcount()
+        keys = keys.where(occurrence == 0, keys + '#' + (occurrence + 1).astype(str))
+        return keys.tolist(), [format(h, 'x') for h in hashes.tolist()]
+
+    def update(self) -> Optional[Dict[str, Any]]:
+        """
+        重新读取数据和模板，生成有变化的记录并删除不再需要的文档
+
+        Returns:
+            生成结果统计，没有需要生成的记录时返回 None
+        """
+        reader = open_reader(self.source, layer=self.layer, encoding=self.encoding, target_crs=self.target_crs)
+        processors = [TemplateProcessor(path) for path in self.template_paths]
+        generator = BatchGenerator(reader, processors, workers=self.workers, render_cache=self.render_cache)
+
+        digests = {p.template_path: p.digest for p in processors}
+        initial = not self.state['templates']
+        templates_changed = digests != self.state['templates']
+
+        keys, hashes = self.record_hashes(reader, self.key_field)
+        reservation = generator.reserve_filenames(self.naming_field)
+        old_records = self.state['records']
+
+        positions = []
+        for position, key in enumerate(keys):
+            old = old_records.get(key)
+            if templates_changed or old is None or old['hash'] != hashes[position] \
+                    or old['filenames'] != reservation[position]:
+                positions.append(position)
+
+        # 删除已删除记录和已改名记录的旧文档
+        current_files = {name for names in reservation for name in names}
+        stale = {name for record in old_records.values() for name in record['filenames']} - current_files
+        for name in stale:
+            path = os.path.join(self.output_dir, f"{name}.docx")
+            if os.path.exists(path):
+                os.remove(path)
+
+        added = sum(1 for key in keys if key not in old_records)
+        removed = len(set(old_records) - set(keys))
+        if initial:
+            summary = "首次运行，生成全部文档"
+        elif templates_changed:
+            summary = "模板已变化，重新生成全部文档"
+        else:
+            summary = f"新增 {added} 条，修改 {len(positions) - added} 条，删除 {removed} 条"
+        print(f"\n[{time.strftime('%H:%M:%S')}] {summary}", file=self.log)
+
+        results = None
+        if positions:
+            results = generator.generate_all(self.output_dir, self.naming_field,
+                                             reservation=reservation, positions=positions,
+                                             progress=self.progress)
+        failed = {name for name, _ in results['failed']} if results else set()
+
+        # 渲染失败的记录不写入状态，下次变化时重试
+        self.state = {
+            'templates': digests,
+            'records': {key: {'hash': hashes[i], 'filenames': reservation[i]}
+                        for i, key in enumerate(keys) if not failed.intersection(reservation[i])},
+        }
+        self._save_state()
+        return results
+
+    def run(self):
+        """持续监视，文件变化并稳定 debounce 秒后更新，按 Ctrl+C 退出"""
+        print(f"正在监视 {self.source} 和 {len(self.template_paths)} 个模板（按 Ctrl+C 退出）", file=self.log)
+        results = self.update()
+        if results:
+            print(f"成功: {len(results['success'])} 个，失败: {len(results['failed'])} 个", file=self.log)
+
+        last = self.snapshot()
+        while True:
+            time.sleep(self.interval)
+            current = self.snapshot()
+            if current == last:
+                continue
+
+            # 等待文件停止变化（Shapefile保存时各组成文件依次写入）
+            changed_at = time.monotonic()
+            while time.monotonic() - changed_at < self.debounce:
+                time.sleep(self.interval)
+                latest = self.snapshot()
+                if latest != current:
+                    current, changed_at = latest, time.monotonic()
+            last = current
+
+            try:
+                results = self.update()
+            except Exception as e:
+                print(f"  警告: 更新失败，将在下次文件变化时重试 - {e}", file=sys.stderr)
+                continue
+            if results:
+                print(f"成功: {len(results['success'])} 个，失败: {len(results['failed'])} 个", file=self.log)
+
+
+def manifest_filename(shard: Tuple[int, int]) -> str:
+    """分片清单文件名"""
+    return f"manifest_shard_{shard[0]}_of_{shard[1]}.json"
+
+
+def merge_manifests(paths: Sequence[str]) -> Dict[str, Any]:
+    """
+    合并各分片的生成清单
+
+    Args:
+        paths: 清单文件或包含清单文件的目录
+
+    Returns:
+        合并后的结果统计，另含分片数、缺失的分片和跨分片重名的文件
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(Path(path).glob('manifest_shard_*_of_*.json')))
+        elif os.path.isfile(path):
+            files.append(Path(path))
+        else:
+            raise ValueError(f"清单文件或目录不存在: {path}")
+    if not files:
+        raise ValueError("未找到分片清单文件（manifest_shard_*_of_*.json）")
+
+    merged = {
+        'success': [],
+        'failed': [],
+        'total': 0,
+        'shards': None,
+        'missing_shards': [],
+        'conflicts': [],
+    }
+    seen_shards = set()
+    seen_files = set()
+    for file in files:
+        with open(file, encoding='utf-8') as f:
+            manifest = json.load(f)
+        index, count = manifest['shard'], manifest['shards']
+        if merged['shards'] is None:
+            merged['shards'] = count
+        elif merged['shards'] != count:
+            raise ValueError(f"分片数不一致: {file} 为 {count}，其他清单为 {merged['shards']}")
+        if index in seen_shards:
+            raise ValueError(f"分片 {index}/{count} 的清单重复: {file}")
+        seen_shards.add(index)
+
+        for filename in manifest['success']:
+            if filename in seen_files:
+                merged['conflicts'].append(filename)
+            seen_files.add(filename)
+        merged['success'].extend(manifest['success'])
+        merged['failed'].extend(tuple(item) for item in manifest['failed'])
+        merged['total'] += manifest['total']
+
+    merged['missing_shards'] = sorted(set(range(1, merged['shards'] + 1)) - seen_shards)
+    return merged
+
+
 class InteractiveCLI:
     """交互式命令行界面"""
 
@@ -299,48 +2005,74 @@ class InteractiveCLI:
         print("=" * 60)
         print()
 
-    def select_shapefile(self) -> str:
-        """选择Shapefile文件"""
-        print("【步骤 1/7】选择Shapefile文件")
+    def select_source(self) -> Tuple[str, Optional[str]]:
+        """选择数据文件（Shapefile、GeoPackage、FileGDB、CSV、Excel），多图层数据源还需选择图层"""
+        print("【步骤 1/7】选择数据文件")
         print(f"当前目录: {self.current_dir}")
         print()
 
-        # 自动查找.shp文件
-        shp_files = list(self.current_dir.rglob("*.shp"))
+        # 自动查找支持的数据文件
+        sources = []
+        for suffix in SUPPORTED_SOURCES:
+            sources.extend(p for p in self.current_dir.rglob(f"*{suffix}")
+                           if not p.name.startswith("~$") and '.gdb' not in p.parent.name.lower())
 
-        if shp_files:
-            print("找到以下Shapefile文件:")
-            for i, shp in enumerate(shp_files, 1):
-                print(f"  {i}. {shp.relative_to(self.current_dir)}")
+        if sources:
+            print("找到以下数据文件:")
+            for i, source in enumerate(sources, 1):
+                print(f"  {i}. {source.relative_to(self.current_dir)}")
             print()
 
-            choice = input(f"请选择 (1-{len(shp_files)}, 或按Enter输入路径): ").strip()
+            choice = input(f"请选择 (1-{len(sources)}, 或按Enter输入路径): ").strip()
 
-            if choice.isdigit() and 1 <= int(choice) <= len(shp_files):
-                selected = shp_files[int(choice) - 1]
+            if choice.isdigit() and 1 <= int(choice) <= len(sources):
+                selected = sources[int(choice) - 1]
                 print(f"✓ 已选择: {selected.relative_to(self.current_dir)}")
                 print()
-                return str(selected)
+                return str(selected), self.select_layer(str(selected))
 
         # 手动输入路径
         while True:
-            path = input("请输入Shapefile路径: ").strip().strip('"')
+            path = input("请输入数据文件路径: ").strip().strip('"')
             full_path = os.path.join(self.current_dir, path)
+            supported = Path(path.rstrip('/\\')).suffix.lower() in SUPPORTED_SOURCES
 
-            if os.path.exists(full_path) and path.lower().endswith('.shp'):
+            if os.path.exists(full_path) and supported:
                 print(f"✓ 已选择: {path}")
                 print()
-                return full_path
-            elif os.path.exists(path) and path.lower().endswith('.shp'):
+                return full_path, self.select_layer(full_path)
+            elif os.path.exists(path) and supported:
                 print(f"✓ 已选择: {path}")
                 print()
-                return path
+                return path, self.select_layer(path)
             else:
-                print("✗ 文件不存在或不是.shp文件，请重新输入")
+                print(f"✗ 文件不存在或格式不支持（支持: {', '.join(SUPPORTED_SOURCES)}），请重新输入")
+
+    def select_layer(self, path: str) -> Optional[str]:
+        """GeoPackage/FileGDB包含多个图层时选择图层"""
+        if Path(path.rstrip('/\\')).suffix.lower() not in ('.gpkg', '.gdb'):
+            return None
+
+        layers = list_layers(path)
+        if len(layers) <= 1:
+            return layers[0] if layers else None
+
+        print("数据源包含以下图层:")
+        for i, layer in enumerate(layers, 1):
+            print(f"  {i}. {layer}")
+        print()
+
+        while True:
+            choice = input(f"请选择图层 (1-{len(layers)}): ").strip()
+            if choice.isdigit() and 1 <= int(choice) <= len(layers):
+                print(f"✓ 已选择图层: {layers[int(choice) - 1]}")
+                print()
+                return layers[int(choice) - 1]
+            print("✗ 无效的选择，请重新输入")
 
-    def display_shapefile_info(self, reader: ShapefileReader):
-        """显示Shapefile信息"""
-        print("【步骤 2/7】读取Shapefile信息")
+    def display_source_info(self, reader: LayerReader):
+        """显示数据源信息"""
+        print("【步骤 2/7】读取数据信息")
         print(f"✓ 成功读取 {reader.get_record_count()} 条记录")
         print()
         print("字段列表:")
@@ -357,8 +2089,8 @@ class InteractiveCLI:
         print("=" * 80)
         print()
 
-    def select_template(self) -> str:
-        """选择Word模板"""
+    def select_templates(self) -> List[str]:
+        """选择Word模板（可同时选择多个，每条记录依次生成每个模板）"""
         print("【步骤 3/7】选择Word模板文件")
         print()
 
@@ -372,13 +2104,15 @@ class InteractiveCLI:
                 print(f"  {i}. {docx.name}")
             print()
 
-            choice = input(f"请选择 (1-{len(docx_files)}, 或按Enter输入路径): ").strip()
+            choice = input(f"请选择 (1-{len(docx_files)}, 多个用逗号分隔, 或按Enter输入路径): ").strip()
+            choices = [c.strip() for c in choice.replace('，', ',').split(',') if c.strip()]
 
-            if choice.isdigit() and 1 <= int(choice) <= len(docx_files):
-                selected = docx_files[int(choice) - 1]
-                print(f"✓ 已选择: {selected.name}")
+            if choices and all(c.isdigit() and 1 <= int(c) <= len(docx_files) for c in choices):
+                selected = [docx_files[int(c) - 1] for c in dict.fromkeys(choices)]
+                for docx in selected:
+                    print(f"✓ 已选择: {docx.name}")
                 print()
-                return str(selected)
+                return [str(docx) for docx in selected]
 
         # 手动输入路径
         while True:
@@ -388,42 +2122,51 @@ class InteractiveCLI:
             if os.path.exists(full_path) and path.lower().endswith('.docx'):
                 print(f"✓ 已选择: {path}")
                 print()
-                return full_path
+                return [full_path]
             elif os.path.exists(path) and path.lower().endswith('.docx'):
                 print(f"✓ 已选择: {path}")
                 print()
-                return path
+                return [path]
             else:
                 print("✗ 文件不存在或不是.docx文件，请重新输入")
 
-    def display_template_info(self, processor: TemplateProcessor, reader: ShapefileReader):
+    def display_template_info(self, processors: List[TemplateProcessor], reader: LayerReader):
         """显示模板信息"""
         print("【步骤 4/7】检测模板占位符")
         print()
 
-        placeholders = processor.get_placeholders()
+        field_set = set(reader.get_fields())
 
-        if not placeholders:
-            print("⚠ 警告: 未在模板中检测到任何占位符")
-            print("占位符格式应为: !字段名!")
-            print()
+        for processor in processors:
+            specs = processor.get_specs()
 
-        print(f"✓ 找到 {len(placeholders)} 个占位符:")
-        print("-" * 60)
+            if len(processors) > 1:
+                print(f"模板: {processor.name}")
 
-        fields = reader.get_fields()
-        field_set = set(fields)
+            if not specs:
+                print("⚠ 警告: 未在模板中检测到任何占位符")
+                print("占位符格式应为: !字段名!")
+                print()
 
-        for i, placeholder in enumerate(placeholders, 1):
-            if placeholder in field_set:
-                print(f"  {i}. !{placeholder}! ✓ (匹配字段: {placeholder})")
-            else:
-                print(f"  {i}. !{placeholder}! ✗ (未找到匹配字段)")
+            print(f"✓ 找到 {len(specs)} 个占位符:")
+            print("-" * 60)
+
+            for i, spec in enumerate(specs, 1):
+                if spec.field in field_set:
+                    print(f"  {i}. !{spec.token}! ✓ (匹配字段: {spec.field})")
+                elif spec.relation is not None and reader.has_field(spec.field):
+                    print(f"  {i}. !{spec.token}! ✓ (关联表: {spec.relation})")
+                elif spec.field in GEOMETRY_FIELDS:
+                    print(f"  {i}. !{spec.token}! ✓ (几何字段: {GEOMETRY_FIELDS[spec.field]})")
+                elif spec.field in IMAGE_FIELDS:
+                    print(f"  {i}. !{spec.token}! ✓ (图片: {IMAGE_FIELDS[spec.field]})")
+                else:
+                    print(f"  {i}. !{spec.token}! ✗ (未找到匹配字段)")
 
-        print("-" * 60)
-        print()
+            print("-" * 60)
+            print()
 
-    def select_naming_field(self, reader: ShapefileReader) -> str:
+    def select_naming_field(self, reader: LayerReader) -> str:
         """选择文件命名字段"""
         print("【步骤 5/7】选择文件命名字段")
         print("提示: 该字段的值将用作生成文档的文件名")
@@ -486,11 +2229,11 @@ class InteractiveCLI:
             print()
             return output_path
 
-    def preview_and_confirm(self, reader: ShapefileReader, naming_field: str, output_dir: str) -> bool:
+    def preview_and_confirm(self, reader: LayerReader, naming_field: str, output_dir: str) -> bool:
         """预览并确认"""
         print("【步骤 7/7】预览并确认")
         print("-" * 60)
-        print(f"Shapefile记录数: {reader.get_record_count()}")
+        print(f"数据记录数: {reader.get_record_count()}")
         print(f"输出目录: {output_dir}")
         print(f"命名字段: {naming_field}")
 
@@ -519,6 +2262,53 @@ class InteractiveCLI:
             print("操作已取消")
             return False
 
+    def display_plan(self, report: Dict[str, Any]):
+        """显示试运行报告"""
+        print()
+        print("=" * 60)
+        print(" " * 20 + "试运行报告")
+        print("=" * 60)
+        print(f"记录数: {report['total_records']}")
+        print(f"文档数: {report['total_documents']}")
+        print()
+
+        if report['missing_placeholders']:
+            print("未匹配字段的占位符:")
+            for template, tokens in report['missing_placeholders'].items():
+                print(f"  ✗ {template}: " + ', '.join(f"!{t}!" for t in tokens))
+        else:
+            print("✓ 所有占位符均有匹配字段")
+        print()
+
+        if report['empty_placeholders']:
+            print(f"存在空值的记录: {report['records_with_empty']} 条")
+            for token, count in sorted(report['empty_placeholders'].items(), key=lambda x: -x[1]):
+                print(f"  !{token}! 为空: {count} 条")
+            print()
+
+        if report['naming_collisions']:
+            print(f"命名字段重复值: {len(report['naming_collisions'])} 个（将自动添加序号）")
+            for value, count in list(report['naming_collisions'].items())[:5]:
+                print(f"  {value or '<空值>'}: {count} 条")
+            if len(report['naming_collisions']) > 5:
+                print(f"  ... 还有 {len(report['naming_collisions']) - 5} 个")
+            print()
+        if report['unnamed']:
+            print(f"⚠ 命名字段为空的记录: {report['unnamed']} 条（将命名为 unnamed）")
+            print()
+
+        print("文件名计划:")
+        for path in report['filenames'][:5]:
+            print(f"  {os.path.basename(path)}")
+        if len(report['filenames']) > 5:
+            print(f"  ... 还有 {len(report['filenames']) - 5} 个文件")
+        print()
+
+        minutes, seconds = divmod(int(report['estimated_seconds']), 60)
+        print(f"预计输出大小: {report['estimated_bytes'] / 1024 / 1024:.1f} MB")
+        print(f"预计耗时: {minutes} 分 {seconds} 秒（不含位置示意图绘制）")
+        print("=" * 60)
+
     def display_results(self, results: Dict[str, Any]):
         """显示生成结果"""
         print()
@@ -541,48 +2331,198 @@ class InteractiveCLI:
         print("=" * 60)
 
 
-def main():
-    """主函数"""
+PROGRESS_MODES = ('bar', 'json', 'none')
+
+
+def progress_listeners(mode: str) -> List[ProgressListener]:
+    """按命令行的 --progress 参数创建监听者"""
+    if mode == 'json':
+        return [JsonLinesProgress()]
+    if mode == 'none':
+        return []
+    return [TqdmProgress()]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """命令行参数，不带子命令时进入交互模式"""
+    parser = argparse.ArgumentParser(description="批量生成调查表工具（不带参数运行时进入交互模式）")
+    subparsers = parser.add_subparsers(dest='command')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('source', help="数据文件路径（.shp/.gpkg/.gdb/.csv/.xlsx）")
+    common.add_argument('--layer', help="图层名（GeoPackage/FileGDB）或工作表名（Excel）")
+    common.add_argument('-t', '--template', action='append', required=True, help="Word模板路径，可重复指定多个")
+    common.add_argument('-n', '--naming-field', required=True, help="用于命名文件的字段")
+    common.add_argument('-o', '--output', default='output', help="输出目录，默认 output")
+    common.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="渲染进程数")
+    common.add_argument('--encoding', help="Shapefile/CSV编码，默认分别为gbk/utf-8")
+    common.add_argument('--target-crs', help="计算面积等几何字段前投影到的坐标系（如 EPSG:4527），经纬度数据必须指定")
+
+    generate_parser = subparsers.add_parser('generate', parents=[common], help="批量生成文档")
+    generate_parser.add_argument('--shard', type=parse_shard, help="只生成第 i 个分片，格式 i/N（如 1/4）")
+    generate_parser.add_argument('--shard-key', help="分片依据的字段，默认使用命名字段")
+    generate_parser.add_argument('--reservation', help="文件名预留文件（由 reserve 子命令生成）")
+    generate_parser.add_argument('--progress', choices=PROGRESS_MODES, default='bar',
+                                 help="进度输出：bar 进度条（默认），json 逐行输出JSON事件，none 不输出")
+    generate_parser.add_argument('--render-cache', help="渲染缓存目录，内容相同的文档只渲染一次，可在多次运行间共用")
+
+    plan_parser = subparsers.add_parser('plan', parents=[common], help="试运行：只检查不生成")
+    plan_parser.add_argument('--json', help="将完整检查报告（含文件名计划）写入JSON文件")
+
+    reserve_parser = subparsers.add_parser('reserve', parents=[common], help="为分片运行预留全局一致的文件名")
+    reserve_parser.add_argument('--reservation', required=True, help="文件名预留文件的保存路径")
+
+    watch_parser = subparsers.add_parser('watch', parents=[common], help="监视数据和模板，变化时只重新生成受影响的文档")
+    watch_parser.add_argument('--key-field', help="区分记录的关键字段，默认使用命名字段")
+    watch_parser.add_argument('--interval', type=float, default=1.0, help="检查文件变化的间隔（秒），默认1")
+    watch_parser.add_argument('--debounce', type=float, default=2.0, help="文件停止变化多久后开始生成（秒），默认2")
+    watch_parser.add_argument('--progress', choices=PROGRESS_MODES, default='bar',
+                              help="进度输出：bar 进度条（默认），json 逐行输出JSON事件，none 不输出")
+    watch_parser.add_argument('--render-cache', help="渲染缓存目录，内容相同的文档只渲染一次")
+
+    merge_parser = subparsers.add_parser('merge', help="合并各分片的生成清单")
+    merge_parser.add_argument('inputs', nargs='+', help="分片清单文件或所在目录")
+    merge_parser.add_argument('--json', help="将合并结果写入JSON文件")
+    return parser
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """解析 i/N 格式的分片参数"""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N 且 1 ≤ i ≤ N: {text}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def run_interactive():
+    """交互模式"""
     cli = InteractiveCLI()
 
-    try:
-        # 显示欢迎信息
-        cli.print_header()
+    # 显示欢迎信息
+    cli.print_header()
 
-        # 步骤1: 选择Shapefile
-        shp_path = cli.select_shapefile()
+    # 步骤1: 选择数据文件
+    source_path, layer = cli.select_source()
 
-        # 读取Shapefile
-        reader = ShapefileReader(shp_path)
+    # 读取数据
+    reader = open_reader(source_path, layer=layer)
 
-        # 步骤2: 显示Shapefile信息
-        cli.display_shapefile_info(reader)
+    # 步骤2: 显示数据信息
+    cli.display_source_info(reader)
 
-        # 步骤3: 选择模板
-        template_path = cli.select_template()
+    # 步骤3: 选择模板
+    template_paths = cli.select_templates()
 
-        # 处理模板
-        processor = TemplateProcessor(template_path)
+    # 处理模板
+    processors = [TemplateProcessor(path) for path in template_paths]
 
-        # 步骤4: 显示模板信息
-        cli.display_template_info(processor, reader)
+    # 步骤4: 显示模板信息
+    cli.display_template_info(processors, reader)
 
-        # 步骤5: 选择命名字段
-        naming_field = cli.select_naming_field(reader)
+    # 步骤5: 选择命名字段
+    naming_field = cli.select_naming_field(reader)
 
-        # 步骤6: 选择输出目录
-        output_dir = cli.select_output_dir()
+    # 步骤6: 选择输出目录
+    output_dir = cli.select_output_dir()
 
-        # 步骤7: 预览并确认
-        if not cli.preview_and_confirm(reader, naming_field, output_dir):
-            sys.exit(0)
+    # 步骤7: 预览并确认
+    if not cli.preview_and_confirm(reader, naming_field, output_dir):
+        sys.exit(0)
 
-        # 批量生成
-        generator = BatchGenerator(reader, processor)
-        results = generator.generate_all(output_dir, naming_field)
+    # 批量生成
+    generator = BatchGenerator(reader, processors, workers=os.cpu_count() or 1)
+    results = generator.generate_all(output_dir, naming_field)
+
+    # 显示结果
+    cli.display_results(results)
+
+
+def run_command(args: argparse.Namespace):
+    """命令行模式"""
+    cli = InteractiveCLI()
 
-        # 显示结果
-        cli.display_results(results)
+    if args.command == 'merge':
+        merged = merge_manifests(args.inputs)
+        cli.display_results(merged)
+        if merged['missing_shards']:
+            missing = ', '.join(f"{i}/{merged['shards']}" for i in merged['missing_shards'])
+            print(f"⚠ 缺少分片: {missing}")
+        if merged['conflicts']:
+            print(f"⚠ 跨分片重名文件: {len(merged['conflicts'])} 个，请确认各分片使用了同一份文件名预留")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(merged, f, ensure_ascii=False, indent=2)
+            print(f"✓ 合并结果已保存: {args.json}")
+        return
+
+    if args.command == 'watch':
+        watcher = BatchWatcher(args.source, args.template, args.output, args.naming_field,
+                               key_field=args.key_field, layer=args.layer, encoding=args.encoding,
+                               target_crs=args.target_crs,
+                               workers=args.workers, interval=args.interval, debounce=args.debounce,
+                               progress=progress_listeners(args.progress), render_cache=args.render_cache,
+                               log=sys.stderr if args.progress == 'json' else None)
+        watcher.run()
+        return
+
+    reader = open_reader(args.source, layer=args.layer, encoding=args.encoding, target_crs=args.target_crs)
+    processors = [TemplateProcessor(path) for path in args.template]
+    render_cache = RenderCache(args.render_cache) if getattr(args, 'render_cache', None) else None
+    generator = BatchGenerator(reader, processors, workers=args.workers, render_cache=render_cache)
+
+    if args.command == 'plan':
+        report = generator.plan(args.output, args.naming_field)
+        cli.display_plan(report)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"✓ 检查报告已保存: {args.json}")
+
+    elif args.command == 'reserve':
+        reservation = {
+            'naming_field': args.naming_field,
+            'templates': [p.name for p in processors],
+            'filenames': generator.reserve_filenames(args.naming_field),
+        }
+        with open(args.reservation, 'w', encoding='utf-8') as f:
+            json.dump(reservation, f, ensure_ascii=False)
+        print(f"✓ 已为 {len(reservation['filenames'])} 条记录预留文件名: {args.reservation}")
+
+    else:
+        reservation = None
+        if args.reservation:
+            with open(args.reservation, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved['naming_field'] != args.naming_field or saved['templates'] != [p.name for p in processors]:
+                raise ValueError("文件名预留文件与当前的命名字段或模板不一致")
+            reservation = saved['filenames']
+
+        results = generator.generate_all(args.output, args.naming_field, shard=args.shard,
+                                         shard_key=args.shard_key, reservation=reservation,
+                                         progress=progress_listeners(args.progress))
+        # JSON模式下标准输出只有事件（警告输出到标准错误），结果见 finished 事件
+        if args.progress != 'json':
+            cli.display_results(results)
+
+        if args.shard:
+            manifest = dict(results, shard=args.shard[0], shards=args.shard[1],
+                            shard_key=args.shard_key or args.naming_field, source=str(args.source))
+            manifest_path = os.path.join(args.output, manifest_filename(args.shard))
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            if args.progress != 'json':
+                print(f"✓ 分片清单已保存: {manifest_path}")
+
+
+def main(argv: Optional[List[str]] = None):
+    """主函数"""
+    args = build_parser().parse_args(argv)
+
+    try:
+        if args.command is None:
+            run_interactive()
+        else:
+            run_command(args)
 
     except KeyboardInterrupt:
         print("\n\n操作已取消")
@@ -8,10 +8,13 @@
 """
 
 import os
+import queue
 import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
+from itertools import islice
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 
@@ -26,7 +29,8 @@ except ImportError as e:
     sys.exit(1)
 
 try:
-    from survey_generator import ShapefileReader, TemplateProcessor, BatchGenerator
+    from survey_generator import (LayerReader, TemplateProcessor, BatchGenerator, ProgressEmitter,
+                                  ProgressEvent, open_reader)
 except ImportError as e:
     tk_root = tk.Tk()
     tk_root.withdraw()
@@ -34,6 +38,20 @@ except ImportError as e:
     sys.exit(1)
 
 
+class GuiProgress:
+    """
+    GUI进度监听者：生成在后台线程中进行，事件放入队列，由界面线程定时取出更新进度条
+
+    Tk组件只能在界面线程中操作，因此监听者本身不直接修改界面。
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue[Any]" = queue.Queue()
+
+    def __call__(self, event: ProgressEvent):
+        self.queue.put(event)
+
+
 class SurveyGeneratorGUI:
     """批量生成调查表GUI"""
 
@@ -52,11 +70,14 @@ class SurveyGeneratorGUI:
         self.template_path = ctk.StringVar(value="")
         self.output_dir = ctk.StringVar(value=str(Path.cwd() / "output"))
         self.naming_field = ctk.StringVar(value="")
+        self.target_crs = ctk.StringVar(value="")
 
         # 组件
-        self.shp_reader: Optional[ShapefileReader] = None
+        self.shp_reader: Optional[LayerReader] = None
         self.template_processor: Optional[TemplateProcessor] = None
         self.preview_data: List[Dict[str, Any]] = []
+        self.progress: Optional[GuiProgress] = None
+        self.generate_button = None
 
         # 创建UI
         self._create_widgets()
@@ -89,11 +110,11 @@ class SurveyGeneratorGUI:
 
     def _create_file_selection(self, parent):
         """创建文件选择区域"""
-        # Shapefile选择
+        # 数据文件选择
         shp_frame = ctk.CTkFrame(parent)
         shp_frame.pack(fill="x", pady=10)
 
-        ctk.CTkLabel(shp_frame, text="Shapefile文件:", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w", padx=10, pady=(10, 5))
+        ctk.CTkLabel(shp_frame, text="数据文件:", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w", padx=10, pady=(10, 5))
 
         shp_path_frame = ctk.CTkFrame(shp_frame)
         shp_path_frame.pack(fill="x", padx=10, pady=5)
@@ -137,6 +158,14 @@ class SurveyGeneratorGUI:
         self.field_combobox.pack(side="left", padx=5)
         ctk.CTkButton(field_frame, text="加载字段", command=self._load_fields, width=120).pack(side="left", padx=5)
 
+        # 目标坐标系（经纬度数据计算面积、周长前需投影）
+        crs_frame = ctk.CTkFrame(config_frame)
+        crs_frame.pack(fill="x", padx=10, pady=5)
+
+        ctk.CTkLabel(crs_frame, text="目标坐标系:", width=100).pack(side="left", padx=5)
+        ctk.CTkEntry(crs_frame, textvariable=self.target_crs, width=300,
+                     placeholder_text="如 EPSG:4527，留空使用原坐标系").pack(side="left", padx=5)
+
     def _create_preview_section(self, parent):
         """创建预览区域"""
         preview_frame = ctk.CTkFrame(parent)
@@ -159,13 +188,14 @@ class SurveyGeneratorGUI:
         button_frame = ctk.CTkFrame(parent)
         button_frame.pack(fill="x", pady=10)
 
-        ctk.CTkButton(
+        self.generate_button = ctk.CTkButton(
             button_frame,
             text="开始生成",
             command=self._generate,
             font=ctk.CTkFont(size=16, weight="bold"),
             height=40
-        ).pack(pady=10)
+        )
+        self.generate_button.pack(pady=10)
 
         # 进度条
         self.progress_bar = ctk.CTkProgressBar(button_frame, width=400)
@@ -177,10 +207,16 @@ class SurveyGeneratorGUI:
         self.status_label.pack(pady=5)
 
     def _browse_shp(self):
-        """浏览Shapefile"""
+        """浏览数据文件"""
         file_path = filedialog.askopenfilename(
-            title="选择Shapefile",
-            filetypes=[("Shapefile", "*.shp"), ("All Files", "*.*")]
+            title="选择数据文件",
+            filetypes=[
+                ("Shapefile", "*.shp"),
+                ("GeoPackage", "*.gpkg"),
+                ("CSV", "*.csv"),
+                ("Excel", "*.xlsx *.xls"),
+                ("All Files", "*.*")
+            ]
         )
         if file_path:
             self.shp_path.set(file_path)
@@ -202,16 +238,16 @@ class SurveyGeneratorGUI:
             self.output_dir.set(dir_path)
 
     def _load_shapefile(self):
-        """加载Shapefile"""
+        """加载数据文件"""
         shp_file = self.shp_path.get()
         if not shp_file:
             return
 
         try:
-            self.status_label.configure(text="正在加载Shapefile...")
+            self.status_label.configure(text="正在加载数据...")
             self.root.update()
 
-            self.shp_reader = ShapefileReader(shp_file)
+            self.shp_reader = open_reader(shp_file, target_crs=self.target_crs.get().strip() or None)
             fields = self.shp_reader.get_fields()
 
             # 更新字段下拉框
@@ -220,20 +256,20 @@ class SurveyGeneratorGUI:
                 self.naming_field.set(fields[0])
 
             # 更新预览数据
-            self.preview_data = self.shp_reader.get_records(limit=10)
+            self.preview_data = list(islice(self.shp_reader.get_records(), 10))
             self._update_preview()
 
             self.status_label.configure(text=f"已加载 {self.shp_reader.get_record_count()} 条记录")
 
         except Exception as e:
-            messagebox.showerror("错误", f"加载Shapefile失败\n\n{str(e)}")
+            messagebox.showerror("错误", f"加载数据失败\n\n{str(e)}")
             self.status_label.configure(text="加载失败")
             traceback.print_exc()
 
     def _load_fields(self):
         """加载字段列表"""
         if not self.shp_reader:
-            messagebox.showwarning("警告", "请先选择Shapefile文件")
+            messagebox.showwarning("警告", "请先选择数据文件")
             return
 
         fields = self.shp_reader.get_fields()
@@ -263,7 +299,7 @@ class SurveyGeneratorGUI:
         """生成文档"""
         # 验证输入
         if not self.shp_path.get():
-            messagebox.showwarning("警告", "请选择Shapefile文件")
+            messagebox.showwarning("警告", "请选择数据文件")
             return
 
         if not self.template_path.get():
@@ -279,17 +315,21 @@ class SurveyGeneratorGUI:
             self.status_label.configure(text="正在加载模板...")
             self.root.update()
 
+            # 加载数据后修改了目标坐标系时重新读取
+            target_crs = self.target_crs.get().strip() or None
+            if self.shp_reader is None or self.shp_reader.target_crs != target_crs:
+                self.shp_reader = open_reader(self.shp_path.get(), target_crs=target_crs)
+
             self.template_processor = TemplateProcessor(self.template_path.get())
             placeholders = self.template_processor.get_placeholders()
             
             # 检查字段匹配
-            fields = self.shp_reader.get_fields()
-            missing_fields = [fld for fld in placeholders if fld not in fields]
+            missing_fields = [fld for fld in placeholders if not self.shp_reader.has_field(fld)]
             
             if missing_fields:
                 result = messagebox.askyesno(
                     "字段不匹配",
-                    f"模板中的占位符在Shapefile中不存在:\n{', '.join(missing_fields)}\n\n是否继续?"
+                    f"模板中的占位符在数据中不存在:\n{', '.join(missing_fields)}\n\n是否继续?"
                 )
                 if not result:
                     return
@@ -299,31 +339,64 @@ class SurveyGeneratorGUI:
             output_path.mkdir(parents=True, exist_ok=True)
 
             # 生成文档
-            naming_field = self.naming_field.get() if self.naming_field.get() else None
-            
-            generator = BatchGenerator(
-                self.shp_reader,
-                self.template_processor,
-                str(output_path),
-                naming_field=naming_field
-            )
+            naming_field = self.naming_field.get() or 'unnamed'
+            generator = BatchGenerator(self.shp_reader, self.template_processor, workers=os.cpu_count() or 1)
 
             self.status_label.configure(text="正在生成文档...")
-            self.root.update()
-
-            # 批量生成
-            total = generator.generate(show_progress=True)
-
-            self.progress_bar.set(1.0)
-            self.status_label.configure(text=f"完成! 已生成 {total} 个文档")
-
-            messagebox.showinfo("成功", f"已成功生成 {total} 个文档\n\n保存位置: {output_path}")
+            self.progress_bar.set(0)
+            self.generate_button.configure(state="disabled")
+
+            # 在后台线程中生成，界面线程定时读取进度事件
+            self.progress = GuiProgress()
+            emitter = ProgressEmitter([self.progress], interval=0.1)
+            threading.Thread(
+                target=self._run_generation,
+                args=(generator, str(output_path), naming_field, emitter),
+                daemon=True
+            ).start()
+            self.root.after(100, self._poll_progress, str(output_path))
 
         except Exception as e:
             messagebox.showerror("错误", f"生成失败\n\n{str(e)}")
             self.status_label.configure(text="生成失败")
             traceback.print_exc()
 
+    def _run_generation(self, generator: BatchGenerator, output_dir: str, naming_field: str,
+                        emitter: ProgressEmitter):
+        """后台线程：批量生成，出错时把异常放入事件队列"""
+        try:
+            generator.generate_all(output_dir, naming_field, progress=emitter)
+        except Exception as e:
+            traceback.print_exc()
+            self.progress.queue.put(e)
+
+    def _poll_progress(self, output_dir: str):
+        """界面线程：取出进度事件更新进度条和状态，生成结束前每100毫秒检查一次"""
+        while True:
+            try:
+                event = self.progress.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if isinstance(event, Exception):
+                self.generate_button.configure(state="normal")
+                self.status_label.configure(text="生成失败")
+                messagebox.showerror("错误", f"生成失败\n\n{str(event)}")
+                return
+
+            if event.kind == 'batch' and event.total:
+                self.progress_bar.set(event.done / event.total)
+                self.status_label.configure(text=f"正在生成文档... {event.done}/{event.total}")
+            elif event.kind == 'finished':
+                self.generate_button.configure(state="normal")
+                self.progress_bar.set(1.0)
+                success, failed = event.detail['success'], event.detail['failed']
+                self.status_label.configure(text=f"完成! 已生成 {success} 个文档，失败 {failed} 个")
+                messagebox.showinfo("成功", f"已成功生成 {success} 个文档，失败 {failed} 个\n\n保存位置: {output_dir}")
+                return
+
+        self.root.after(100, self._poll_progress, output_dir)
+
 
 def main():
     """主函数"""
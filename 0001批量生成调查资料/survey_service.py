@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量生成调查表工具 - 本地渲染服务
+功能：常驻内存加载数据和已编译模板，通过HTTP按关键字或筛选条件渲染调查表
+"""
+
+import argparse
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Iterator, Any, Optional, Sequence
+from urllib.parse import urlparse, parse_qs, quote
+
+from survey_generator import (TemplateProcessor, BatchGenerator, open_reader, format_column,
+                              source_files, file_snapshot, _init_worker, _render_document)
+
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# 查询参数中的保留字，其余参数均作为筛选字段
+RESERVED_PARAMS = ('key', 'template', 'limit')
+
+
+class RenderService:
+    """
+    渲染服务：数据、已编译模板和渲染进程池只加载一次，最近渲染的文档保存在LRU缓存中
+
+    每次请求前检查数据文件和模板是否变化，变化时重新加载并清空缓存。
+    """
+
+    def __init__(self, source: str, template_paths: Sequence[str], naming_field: str,
+                 key_field: Optional[str] = None, layer: Optional[str] = None, encoding: Optional[str] = None,
+                 target_crs: Any = None, workers: int = 1, cache_size: int = 256):
+        """
+        初始化渲染服务
+
+        Args:
+            source: 数据文件路径
+            template_paths: 模板路径列表
+            naming_field: 用于命名字段
+            key_field: 按关键字渲染时查找的字段，默认使用命名字段
+            layer: 图层名（GeoPackage/FileGDB）或工作表名（Excel）
+            encoding: 文件编码
+            target_crs: 计算几何虚拟字段前投影到的坐标系（如 'EPSG:4527'）
+            workers: 渲染进程数，1表示在服务进程中渲染
+            cache_size: 缓存的文档数量
+        """
+        self.source = source
+        self.template_paths = list(template_paths)
+        self.naming_field = naming_field
+        self.key_field = key_field or naming_field
+        self.layer = layer
+        self.encoding = encoding
+        self.target_crs = target_crs
+        self.workers = max(1, workers)
+        self.cache_size = cache_size
+
+        self.cache: 'OrderedDict[Tuple[int, int], bytes]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.RLock()
+        self._render_lock = threading.Lock()
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self.load()
+
+    def watched_files(self) -> List[str]:
+        """数据文件和模板"""
+        return source_files(self.source) + self.template_paths
+
+    def load(self):
+        """加载数据和模板，编译结果分发到渲染进程，并清空缓存"""
+        snapshot = file_snapshot(self.watched_files())
+        reader = open_reader(self.source, layer=self.layer, encoding=self.encoding, target_crs=self.target_crs)
+        if self.key_field not in reader.gdf.columns:
+            raise ValueError(f"关键字段不存在: {self.key_field}")
+        generator = BatchGenerator(reader, [TemplateProcessor(path) for path in self.template_paths])
+
+        keys = format_column(reader.gdf[self.key_field]).reset_index(drop=True)
+        executor = None
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                           initargs=(generator.templates, generator.map_renderer))
+
+        with self._lock:
+            old_executor = self.executor
+            self.reader = reader
+            self.generator = generator
+            self.records = list(reader.get_records(generator._collect_specs()))
+            self.filenames = generator.reserve_filenames(self.naming_field)
+            self.key_index = {key: list(positions) for key, positions in keys.groupby(keys).indices.items()}
+            self.executor = executor
+            self.cache.clear()
+            self._snapshot = snapshot
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+
+    def refresh(self):
+        """
+        数据文件或模板变化时重新加载，加载失败（如文件正在保存）时继续使用原数据
+
+        检查和重新加载都在锁内进行，多个请求同时发现变化时只加载一次。
+        """
+        with self._lock:
+            if file_snapshot(self.watched_files()) == self._snapshot:
+                return
+            try:
+                self.load()
+                self.stats['reloads'] += 1
+                print(f"已重新加载: {self.source}")
+            except Exception as e:
+                print(f"  警告: 重新加载失败，继续使用原数据 - {e}")
+
+    def template_indexes(self, name: Optional[str] = None) -> List[int]:
+        """按模板名选择模板，为空时选择全部模板"""
+        templates = self.generator.templates
+        if name is None:
+            return list(range(len(templates)))
+        for index, template in enumerate(templates):
+            if template.name == name:
+                return [index]
+        raise KeyError(f"模板不存在: {name}")
+
+    def find_by_key(self, key: str) -> List[int]:
+        """按关键字查找记录序号"""
+        return self.key_index.get(key, [])
+
+    def find_by_filter(self, conditions: Dict[str, List[str]]) -> List[int]:
+        """
+        按字段值筛选记录，同一字段的多个值为“或”，不同字段之间为“且”
+
+        Args:
+            conditions: {字段名: [值, ...]}
+
+        Returns:
+            记录序号列表
+        """
+        gdf = self.reader.gdf
+        mask = None
+        for field, values in conditions.items():
+            if field not in gdf.columns or field == 'geometry':
+                raise KeyError(f"字段不存在: {field}")
+            matched = format_column(gdf[field]).isin(values).to_numpy()
+            mask = matched if mask is None else mask & matched
+        if mask is None:
+            return []
+        return mask.nonzero()[0].tolist()
+
+    def render(self, targets: List[Tuple[int, int]]) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """
+        按顺序渲染 (记录序号, 模板序号)，已缓存的文档直接返回
+
+        Returns:
+            (文件名, 文档内容) 迭代器，渲染失败时内容为 None
+        """
+        with self._lock:
+            records, filenames, templates = self.records, self.filenames, self.generator.templates
+            renderer, executor = self.generator.map_renderer, self.executor
+            cached = {target: self.cache.get(target) for target in targets}
+
+        missing = [target for target in targets if cached[target] is None]
+        jobs = [(position, records[position], index) for position, index in missing]
+        if executor is not None:
+            futures = [executor.submit(_render_document, job) for job in jobs]
+            rendered = (future.result() for future in futures)
+        else:
+            rendered = (self._render_local(job, templates, renderer) for job in jobs)
+
+        # 统计和LRU顺序在返回每个文档之前更新，调用方只取第一个文档时也有效
+        for target in targets:
+            content = cached[target]
+            if content is None:
+                content = next(rendered)
+                with self._lock:
+                    self.stats['misses'] += 1
+                # 渲染期间数据已重新加载时不写入缓存
+                if content is not None and records is self.records:
+                    self._remember(target, content)
+            else:
+                with self._lock:
+                    self.stats['hits'] += 1
+                    if target in self.cache:
+                        self.cache.move_to_end(target)
+            position, index = target
+            yield f"{filenames[position][index]}.docx", content
+
+    def _render_local(self, job: Tuple[int, Dict[str, str], int], templates, renderer) -> Optional[bytes]:
+        """在服务进程中渲染（单进程模式），示意图渲染器复用同一画布，不能并发使用"""
+        if renderer is None:
+            return _render_document(job, templates, renderer)
+        with self._render_lock:
+            return _render_document(job, templates, renderer)
+
+    def _remember(self, target: Tuple[int, int], content: bytes):
+        """加入缓存，超出容量时移除最久未使用的文档"""
+        with self._lock:
+            self.cache[target] = content
+            self.cache.move_to_end(target)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def status(self) -> Dict[str, Any]:
+        """服务状态"""
+        with self._lock:
+            return {
+                'source': self.source,
+                'records': len(self.records),
+                'templates': [template.name for template in self.generator.templates],
+                'key_field': self.key_field,
+                'workers': self.workers,
+                'cached_documents': len(self.cache),
+                **self.stats,
+            }
+
+    def close(self):
+        """关闭渲染进程池"""
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP接口：
+
+        GET /render?key=关键字[&template=模板名]         单个文档返回docx，多个文档返回zip
+        GET /batch?字段=值[&字段=值...][&template=模板名][&limit=N]   筛选记录，流式返回zip
+        GET /status                                      服务状态
+    """
+
+    service: RenderService = None
+
+    def do_GET(self):
+        # 未做百分号编码的中文参数按UTF-8还原（http.server按latin-1解码请求行）
+        try:
+            path = self.path.encode('latin-1').decode('utf-8')
+        except UnicodeError:
+            path = self.path
+        url = urlparse(path)
+        params = parse_qs(url.query)
+        try:
+            if url.path == '/status':
+                self._send_json(200, self.service.status())
+                return
+
+            self.service.refresh()
+            template = params.get('template', [None])[0]
+            indexes = self.service.template_indexes(template)
+
+            if url.path == '/render':
+                if 'key' not in params:
+                    self._send_json(400, {'error': "缺少参数: key"})
+                    return
+                positions = [p for key in params['key'] for p in self.service.find_by_key(key)]
+                if not positions:
+                    self._send_json(404, {'error': f"未找到记录: {', '.join(params['key'])}"})
+                    return
+            elif url.path == '/batch':
+                conditions = {k: v for k, v in params.items() if k not in RESERVED_PARAMS}
+                if not conditions:
+                    self._send_json(400, {'error': "缺少筛选条件，如 /batch?ZZSXDM=1"})
+                    return
+                positions = self.service.find_by_filter(conditions)
+                if 'limit' in params:
+                    positions = positions[:int(params['limit'][0])]
+                if not positions:
+                    self._send_json(404, {'error': "没有符合条件的记录"})
+                    return
+            else:
+                self._send_json(404, {'error': f"未知路径: {url.path}"})
+                return
+        except KeyError as e:
+            self._send_json(400, {'error': e.args[0]})
+            return
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        targets = [(position, index) for position in positions for index in indexes]
+        if url.path == '/render' and len(targets) == 1:
+            self._send_document(targets)
+        else:
+            self._send_zip(targets)
+
+    def _send_json(self, code: int, data: Dict[str, Any]):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_headers(self, content_type: str, filename: str, length: Optional[int] = None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(filename)}")
+        if length is not None:
+            self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+    def _send_document(self, targets: List[Tuple[int, int]]):
+        filename, content = next(self.service.render(targets))
+        if content is None:
+            self._send_json(500, {'error': f"渲染失败: {filename}"})
+            return
+        self._send_headers(DOCX_MIME, filename, len(content))
+        self.wfile.write(content)
+
+    def _send_zip(self, targets: List[Tuple[int, int]]):
+        """边渲染边写入zip，不等待全部文档渲染完成（HTTP/1.0，以关闭连接表示结束）"""
+        self._send_headers('application/zip', 'documents.zip')
+        failed = []
+        # docx本身已压缩，zip中直接存储
+        with zipfile.ZipFile(self.wfile, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for filename, content in self.service.render(targets):
+                if content is None:
+                    failed.append(filename)
+                else:
+                    archive.writestr(filename, content)
+            if failed:
+                archive.writestr('failed.txt', '\n'.join(failed))
+
+    def log_message(self, format, *args):
+        print(f"[{self.log_date_time_string()}] {format % args}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """命令行参数"""
+    parser = argparse.ArgumentParser(description="批量生成调查表工具 - 本地渲染服务")
+    parser.add_argument('source', help="数据文件（.shp/.gpkg/.gdb/.csv/.xlsx）")
+    parser.add_argument('--layer', help="图层名（GeoPackage/FileGDB）或工作表名（Excel）")
+    parser.add_argument('-t', '--template', action='append', required=True, help="Word模板，可重复指定多个")
+    parser.add_argument('-n', '--naming-field', required=True, help="用于命名文件的字段")
+    parser.add_argument('--key-field', help="按关键字渲染时查找的字段，默认使用命名字段")
+    parser.add_argument('--encoding', help="文件编码（Shapefile默认gbk，CSV默认utf-8）")
+    parser.add_argument('--target-crs', help="计算面积等几何字段前投影到的坐标系（如 EPSG:4527），经纬度数据必须指定")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="渲染进程数，默认CPU核数")
+    parser.add_argument('--cache-size', type=int, default=256, help="缓存的文档数量，默认256")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址，默认127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口，默认8765")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    """主函数"""
+    args = build_parser().parse_args(argv)
+    service = RenderService(args.source, args.template, args.naming_field, key_field=args.key_field,
+                            layer=args.layer, encoding=args.encoding, target_crs=args.target_crs,
+                            workers=args.workers, cache_size=args.cache_size)
+    RenderRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), RenderRequestHandler)
+    print(f"渲染服务已启动: http://{args.host}:{args.port}（{len(service.records)} 条记录，按 Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服务已停止")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()